@@ -3,18 +3,99 @@ import cv2
 import numpy as np
 import time
 import dlib
-from imutils import face_utils
-from scipy.spatial import distance as dist
+import math
 import os
+import queue
+import threading
+import warnings
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _ear(pts, o):
+    """Eye aspect ratio of the 6-point eye starting at row o of an int32 landmark buffer
+    
+    Differences and squared lengths stay in exact integer arithmetic; only
+    the three square roots and the final ratio are floating point.
+    """
+    ax = pts[o + 1, 0] - pts[o + 5, 0]
+    ay = pts[o + 1, 1] - pts[o + 5, 1]
+    bx = pts[o + 2, 0] - pts[o + 4, 0]
+    by = pts[o + 2, 1] - pts[o + 4, 1]
+    cx = pts[o, 0] - pts[o + 3, 0]
+    cy = pts[o, 1] - pts[o + 3, 1]
+    a2 = ax * ax + ay * ay
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    return (math.sqrt(a2) + math.sqrt(b2)) / (2.0 * math.sqrt(c2))
+
+
+def _eye_ears(pts):
+    """Right and left EAR from a contiguous (12, 2) int32 buffer, right eye first"""
+    return _ear(pts, 0), _ear(pts, 6)
+
+
+# JIT-compile the EAR kernels when numba is available; without it the same
+# scalar code runs as plain Python, so both paths give identical results
+if njit is not None:
+    _ear = njit('f8(i4[:, ::1], i8)', cache=True, fastmath=True)(_ear)
+    _eye_ears = njit('UniTuple(f8, 2)(i4[:, ::1])', cache=True, fastmath=True)(_eye_ears)
+
+
+# Landmark models - a 12-point eye-only predictor (right eye 0-5, left eye
+# 6-11) is used when present since EAR needs nothing else
+EYE_PREDICTOR_PATH = "shape_predictor_eyes.dat"
+FULL_PREDICTOR_PATH = "shape_predictor_68_face_landmarks.dat"
+
+# OpenCV DNN face detector, preferred over HOG for full-frame scans when present
+DNN_PROTOTXT_PATH = "deploy.prototxt"
+DNN_MODEL_PATH = "res10_300x300_ssd_iter_140000.caffemodel"
+
+# A 640x480 HOG scan slower than this suggests a dlib build without SIMD
+_SLOW_DETECT_SECONDS = 0.15
 
 class AdvancedLivenessDetector:
+    # dlib models are read-only after loading, so one copy is shared by
+    # every instance and thread instead of reloading the ~100MB predictor
+    _detector = None
+    _predictor = None
+    _eye_only = False
+    _load_lock = threading.Lock()
+    
+    @classmethod
+    def _load(cls):
+        """Load the shared dlib detector and shape predictor once"""
+        with cls._load_lock:
+            if cls._predictor is None:
+                cls._detector = dlib.get_frontal_face_detector()
+                cls._eye_only = os.path.exists(EYE_PREDICTOR_PATH)
+                path = EYE_PREDICTOR_PATH if cls._eye_only else FULL_PREDICTOR_PATH
+                cls._predictor = dlib.shape_predictor(path)
+                cls._check_dlib_build()
+    
     def __init__(self):
-        self.detector = dlib.get_frontal_face_detector()
-        self.predictor = dlib.shape_predictor("shape_predictor_68_face_landmarks.dat")
+        self._load()
+        self.detector = self._detector
+        self.predictor = self._predictor
+        
+        # Net.forward is not thread-safe, so each instance loads its own (small) net
+        self.face_net = None
+        self._dnn_min_confidence = 0.5
+        if os.path.exists(DNN_PROTOTXT_PATH) and os.path.exists(DNN_MODEL_PATH):
+            self.face_net = cv2.dnn.readNetFromCaffe(DNN_PROTOTXT_PATH, DNN_MODEL_PATH)
+            self.face_net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.face_net.setPreferableTarget(cv2.dnn.DNN_TARGET_OPENCL_FP16)
         
         # Eye landmarks indices
-        self.LEFT_EYE_START, self.LEFT_EYE_END = 42, 48
-        self.RIGHT_EYE_START, self.RIGHT_EYE_END = 36, 42
+        if self._eye_only:
+            self.LEFT_EYE_START, self.LEFT_EYE_END = 6, 12
+            self.RIGHT_EYE_START, self.RIGHT_EYE_END = 0, 6
+        else:
+            self.LEFT_EYE_START, self.LEFT_EYE_END = 42, 48
+            self.RIGHT_EYE_START, self.RIGHT_EYE_END = 36, 42
         
         # Thresholds
         self.EYE_AR_THRESH = 0.25
@@ -25,59 +106,345 @@ class AdvancedLivenessDetector:
         self.blink_counter = 0
         self.total_blinks = 0
         self.frame_count = 0
-        self.start_time = None
+        
+        # Confidence weights: 0.6 for two blinks, 0.5 per second of video
+        self._assumed_fps = 30.0
+        self._blink_scale = 0.6 / 2.0
+        self._time_scale = 0.5 / self._assumed_fps
+        
+        # Face tracking - full-frame detection only every N frames,
+        # otherwise search a padded ROI around the last face
+        self._last_rect = None
+        self._frames_since_detect = 0
+        self._detect_every = 5
+        self._roi_pad = 0.2
+        
+        # Full-frame HOG scan runs on a downscaled copy; landmarks use native scale
+        self._detect_scale = 0.5
+        
+        # CLAHE for retrying missed detections, created on first miss
+        self._clahe = None
+        
+        # Per-frame preprocessing buffers, reused while the frame size is stable
+        self._gray_buf = None
+        self._resized_buf = None
+        
+        # Integer eye landmark buffer (right eye rows 0-5, left eye 6-11)
+        self._eye_pts = np.empty((12, 2), dtype=np.int32)
+        
+        # EAR smoothing and eye-patch tracking between landmark fits
+        self._ear_alpha = 0.6
+        self._ear_smooth = None
+        self._eye_templates = None
+        self._template_ear = None
+        self._frames_since_landmarks = 0
+        self._landmark_every = 4
+        self._template_search = 4
+        self._template_min_score = 0.9
+        
+        # Result template - filled in place each frame, callers get a shallow copy
+        self._result = {
+            'live': False,
+            'confidence': 0.0,
+            'message': '',
+            'blinks': 0,
+            'eye_aspect_ratio': 0.0,
+            'frame_count': 0,
+            'method': 'advanced'
+        }
+        
+        # Background capture pipeline (see start_pipeline)
+        self._pipeline_queue = None
+        self._pipeline_thread = None
+        self._pipeline_running = False
+    
+    @classmethod
+    def _check_dlib_build(cls):
+        """Warn when dlib looks like it was built without AVX/NEON
+        
+        The HOG detector and shape predictor dominate per-frame time and
+        rely on SIMD inner loops; a generic wheel can be several times slower.
+        On ARM a PGO build (-fprofile-generate / -fprofile-use) helps further.
+        """
+        simd = getattr(dlib, 'USE_AVX_INSTRUCTIONS', None)
+        if not simd:
+            # AVX is reported False on ARM builds, so NEON decides there
+            neon = getattr(dlib, 'USE_NEON_INSTRUCTIONS', None)
+            if neon is not None:
+                simd = neon
+        
+        if simd is None:
+            # Build flags not exposed - fall back to timing a dummy scan
+            start = time.perf_counter()
+            cls._detector(np.zeros((480, 640), dtype=np.uint8), 0)
+            simd = (time.perf_counter() - start) < _SLOW_DETECT_SECONDS
+        
+        if not simd:
+            warnings.warn(
+                "dlib appears to be built without AVX/NEON; liveness detection will be slow. "
+                "Rebuild with: CMAKE_ARGS=\"-DUSE_AVX_INSTRUCTIONS=1\" pip install --no-binary :all: dlib",
+                RuntimeWarning
+            )
     
     def eye_aspect_ratio(self, eye):
         """Calculate eye aspect ratio for blink detection"""
-        A = dist.euclidean(eye[1], eye[5])
-        B = dist.euclidean(eye[2], eye[4])
-        C = dist.euclidean(eye[0], eye[3])
+        A = math.hypot(eye[1][0] - eye[5][0], eye[1][1] - eye[5][1])
+        B = math.hypot(eye[2][0] - eye[4][0], eye[2][1] - eye[4][1])
+        C = math.hypot(eye[0][0] - eye[3][0], eye[0][1] - eye[3][1])
         return (A + B) / (2.0 * C)
     
-    def check_liveness(self, frame):
-        """Advanced liveness detection using facial landmarks"""
-        self.frame_count += 1
+    def _detect_in_roi(self, gray):
+        """Run the HOG detector only inside a padded box around the last face"""
+        r = self._last_rect
+        pad_x = int(r.width() * self._roi_pad)
+        pad_y = int(r.height() * self._roi_pad)
+        h, w = gray.shape[:2]
+        x0 = max(r.left() - pad_x, 0)
+        y0 = max(r.top() - pad_y, 0)
+        x1 = min(r.right() + pad_x, w)
+        y1 = min(r.bottom() + pad_y, h)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        
+        rects = self.detector(gray[y0:y1, x0:x1], 0)
+        if len(rects) == 0:
+            return None
+        
+        # Map ROI coordinates back to the full frame
+        rect = rects[0]
+        return dlib.rectangle(rect.left() + x0, rect.top() + y0,
+                              rect.right() + x0, rect.bottom() + y0)
+    
+    def _detect_dnn(self, color, shape):
+        """Run the res10 SSD face detector on a BGR frame and return the most
+        confident box in the coordinates of a grayscale image of the given shape
+        """
+        h, w = shape[:2]
+        # The SSD was trained on BGR with these channel means - it needs the colour frame
+        small = cv2.resize(color, (300, 300), interpolation=cv2.INTER_AREA)
+        blob = cv2.dnn.blobFromImage(small, 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.face_net.setInput(blob)
+        detections = self.face_net.forward()[0, 0]
+        if len(detections) == 0:
+            return None
+        
+        best = detections[detections[:, 2].argmax()]
+        if best[2] < self._dnn_min_confidence:
+            return None
+        
+        x0, y0, x1, y1 = best[3:7] * np.array([w, h, w, h])
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1), w - 1), min(int(y1), h - 1)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return dlib.rectangle(x0, y0, x1, y1)
+    
+    def _detect_full_frame(self, gray, color=None):
+        """Run the face detector on a downscaled frame and map the box back
+        
+        The DNN detector needs the BGR frame; grayscale-only callers use HOG.
+        """
+        if self.face_net is not None and color is not None:
+            return self._detect_dnn(color, gray.shape)
         
-        if self.start_time is None:
-            self.start_time = time.time()
+        scale = self._detect_scale
+        gray_small = cv2.resize(gray, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        rects = self.detector(gray_small, 0)
+        if len(rects) == 0:
+            return None
+        
+        rect = rects[0]
+        return dlib.rectangle(int(rect.left() / scale), int(rect.top() / scale),
+                              int(rect.right() / scale), int(rect.bottom() / scale))
+    
+    def _detect_face(self, gray, color=None):
+        """Locate the face, tracking the previous box between full detections"""
+        rect = None
+        if self._last_rect is not None and self._frames_since_detect < self._detect_every:
+            rect = self._detect_in_roi(gray)
+            self._frames_since_detect += 1
+        
+        # Fall back to a full-frame scan on a miss or every Nth frame
+        if rect is None:
+            rect = self._detect_full_frame(gray, color)
+            self._frames_since_detect = 0
+        
+        # Hard lighting - equalize and retry once, only paying for it on misses
+        if rect is None:
+            if self._clahe is None:
+                self._clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            rect = self._detect_full_frame(self._clahe.apply(gray))
+        
+        self._last_rect = rect
+        return rect
+    
+    def _store_eye_templates(self, gray, eyes, ear):
+        """Cache each eye's patch so following frames can skip the predictor"""
+        h, w = gray.shape[:2]
+        templates = []
+        for eye in eyes:
+            x0, y0 = np.floor(eye.min(axis=0)).astype(int) - 2
+            x1, y1 = np.ceil(eye.max(axis=0)).astype(int) + 3
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, w), min(y1, h)
+            if x1 - x0 < 4 or y1 - y0 < 2:
+                self._eye_templates = None
+                return
+            templates.append((gray[y0:y1, x0:x1].copy(), x0, y0))
+        
+        self._eye_templates = templates
+        self._template_ear = ear
+        self._frames_since_landmarks = 0
+    
+    def _match_eye_templates(self, gray):
+        """Return the cached EAR if both eyes look unchanged, else None
+        
+        Landmarks are refitted every few frames regardless, and whenever an
+        eye patch stops matching (blink, movement), so the blink state
+        machine still sees every real EAR change.
+        """
+        if self._eye_templates is None or self._frames_since_landmarks >= self._landmark_every:
+            return None
         
-        elapsed_time = time.time() - self.start_time
+        h, w = gray.shape[:2]
+        r = self._template_search
+        for template, x0, y0 in self._eye_templates:
+            th, tw = template.shape
+            sx0, sy0 = max(x0 - r, 0), max(y0 - r, 0)
+            sx1, sy1 = min(x0 + tw + r, w), min(y0 + th + r, h)
+            search = gray[sy0:sy1, sx0:sx1]
+            if search.shape[0] < th or search.shape[1] < tw:
+                return None
+            scores = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
+            if scores.max() < self._template_min_score:
+                return None
         
-        # Resize for faster processing
+        self._frames_since_landmarks += 1
+        return self._template_ear
+    
+    @staticmethod
+    def _buffer(buf, shape):
+        """Return buf if it already has the given shape, else a fresh uint8 array"""
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=np.uint8)
+        return buf
+    
+    def _preprocess(self, frame, is_gray=False, reuse=True):
+        """Reduce a camera frame to a grayscale image at most 640px wide
+        
+        With reuse=True the result lives in a buffer owned by this detector
+        and is overwritten by the next call.
+        """
         height, width = frame.shape[:2]
+        
+        # HOG and the shape predictor ignore colour - grayscale input needs no
+        # conversion, and for BGR the green channel is enough
+        if is_gray or frame.ndim == 2:
+            gray = frame
+        elif reuse:
+            self._gray_buf = self._buffer(self._gray_buf, (height, width))
+            gray = cv2.extractChannel(frame, 1, dst=self._gray_buf)
+        else:
+            gray = cv2.extractChannel(frame, 1)
+        
+        # Resize for faster processing - done on the single-channel image so
+        # only a third of the bytes go through the resize kernel
         if width > 640:
             scale = 640 / width
             new_height = int(height * scale)
-            frame = cv2.resize(frame, (640, new_height))
+            if reuse:
+                self._resized_buf = self._buffer(self._resized_buf, (new_height, 640))
+                gray = cv2.resize(gray, (640, new_height), dst=self._resized_buf,
+                                  interpolation=cv2.INTER_AREA)
+            else:
+                gray = cv2.resize(gray, (640, new_height), interpolation=cv2.INTER_AREA)
+        
+        return gray
+    
+    @staticmethod
+    def _preprocess_umat(frame):
+        """OpenCL variant of _preprocess - channel extraction and resize on the GPU"""
+        height, width = frame.shape[:2]
+        u = cv2.UMat(frame)
+        if frame.ndim == 3:
+            u = cv2.extractChannel(u, 1)
+        if width > 640:
+            new_height = int(height * 640 / width)
+            u = cv2.resize(u, (640, new_height), interpolation=cv2.INTER_AREA)
+        return u.get()
+    
+    @staticmethod
+    def check_liveness_batch(detectors, frames):
+        """Run liveness for several camera streams at once
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detectors[i] holds the blink/tracking state of the stream that
+        produced frames[i]; the dlib models themselves are shared. With
+        OpenCL available, preprocessing is offloaded via UMat, which only
+        pays off when many or large frames amortise the upload.
+        """
+        use_ocl = cv2.ocl.haveOpenCL()
+        results = []
+        for detector, frame in zip(detectors, frames):
+            if use_ocl:
+                gray = AdvancedLivenessDetector._preprocess_umat(frame)
+            else:
+                gray = detector._preprocess(frame, reuse=False)
+            results.append(detector.check_liveness(gray, is_gray=True))
+        return results
+    
+    def check_liveness(self, frame, is_gray=False):
+        """Advanced liveness detection using facial landmarks
         
-        # Detect faces
-        rects = self.detector(gray, 0)
+        Accepts a BGR or single-channel frame. Camera loops should prefer
+        grabbing grayscale directly (e.g. cap.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+        so no colour conversion is needed per frame.
+        """
+        self.frame_count += 1
         
-        if len(rects) == 0:
-            return {
-                'live': False,
-                'confidence': 0.0,
-                'message': 'No face detected',
-                'blinks': self.total_blinks,
-                'frame_count': self.frame_count,
-                'method': 'advanced'
-            }
-        
-        # Get facial landmarks
-        shape = self.predictor(gray, rects[0])
-        shape = face_utils.shape_to_np(shape)
-        
-        # Extract eye regions
-        left_eye = shape[self.LEFT_EYE_START:self.LEFT_EYE_END]
-        right_eye = shape[self.RIGHT_EYE_START:self.RIGHT_EYE_END]
-        
-        # Calculate eye aspect ratios
-        left_ear = self.eye_aspect_ratio(left_eye)
-        right_ear = self.eye_aspect_ratio(right_eye)
-        ear = (left_ear + right_ear) / 2.0
+        gray = self._preprocess(frame, is_gray)
+        
+        # Detect face - the DNN detector gets the original BGR frame
+        color = frame if self.face_net is not None and not is_gray and frame.ndim == 3 else None
+        rect = self._detect_face(gray, color)
+        
+        if rect is None:
+            self._eye_templates = None
+            result = self._result
+            result['live'] = False
+            result['confidence'] = 0.0
+            result['message'] = 'No face detected'
+            result['blinks'] = self.total_blinks
+            result['eye_aspect_ratio'] = 0.0
+            result['frame_count'] = self.frame_count
+            return result.copy()
+        
+        # Reuse the last EAR while both eye patches still match their templates
+        raw_ear = self._match_eye_templates(gray)
+        
+        if raw_ear is None:
+            # Get facial landmarks - only the 12 eye points are read out
+            shape = self.predictor(gray, rect)
+            
+            # Both eyes are adjacent in the landmark layout (right then left),
+            # so they fill one (12, 2) buffer; dlib points are already integers
+            eye_pts = self._eye_pts
+            for i, idx in enumerate(range(self.RIGHT_EYE_START, self.LEFT_EYE_END)):
+                p = shape.part(idx)
+                eye_pts[i, 0] = p.x
+                eye_pts[i, 1] = p.y
+            
+            # Calculate both eye aspect ratios in one call
+            right_ear, left_ear = _eye_ears(eye_pts)
+            raw_ear = float(left_ear + right_ear) / 2.0
+            
+            self._store_eye_templates(gray, eye_pts.reshape(2, 6, 2), raw_ear)
+        
+        # Smooth landmark jitter out of the EAR signal
+        if self._ear_smooth is None:
+            self._ear_smooth = raw_ear
+        else:
+            self._ear_smooth += self._ear_alpha * (raw_ear - self._ear_smooth)
+        ear = self._ear_smooth
         
         # Detect blinks
         if ear < self.EYE_AR_THRESH:
@@ -88,15 +455,13 @@ class AdvancedLivenessDetector:
             self.blink_counter = 0
         
         # Calculate confidence
-        confidence = 0.0
-        
         #  Blink detection (60%)
-        blink_score = min(self.total_blinks / 2.0, 1.0) * 0.6
-        confidence += blink_score
+        blink_score = min(self.total_blinks * self._blink_scale, 0.6)
+        
+        # Time-based (40%) - elapsed time estimated from the frame counter
+        time_score = min(self.frame_count * self._time_scale, 0.4)
         
-        # Time-based (40%)
-        time_score = min(elapsed_time / 2.0, 0.4)
-        confidence += time_score
+        confidence = blink_score + time_score
         
         # Determine if live
         is_live = confidence >= 0.5
@@ -109,19 +474,79 @@ class AdvancedLivenessDetector:
         else:
             message = " Verifying liveness..."
         
-        return {
-            'live': is_live,
-            'confidence': round(confidence, 2),
-            'message': message,
-            'blinks': self.total_blinks,
-            'eye_aspect_ratio': round(ear, 3),
-            'frame_count': self.frame_count,
-            'method': 'advanced'
-        }
+        result = self._result
+        result['live'] = is_live
+        result['confidence'] = round(confidence, 2)
+        result['message'] = message
+        result['blinks'] = self.total_blinks
+        result['eye_aspect_ratio'] = round(ear, 3)
+        result['frame_count'] = self.frame_count
+        return result.copy()
+    
+    def start_pipeline(self, cap):
+        """Capture and preprocess frames on a background thread
+        
+        The capture thread keeps only the newest grayscale frame, so HOG
+        latency in check_liveness_pipelined never stalls the camera.
+        """
+        self.stop_pipeline()
+        self._pipeline_queue = queue.Queue(maxsize=1)
+        self._pipeline_running = True
+        self._pipeline_thread = threading.Thread(target=self._capture_loop, args=(cap,), daemon=True)
+        self._pipeline_thread.start()
+    
+    def _capture_loop(self, cap):
+        # dlib already parallelises HOG; keep OpenCV from oversubscribing cores.
+        # setNumThreads is process-wide, so the previous value comes back on stop
+        prev_threads = cv2.getNumThreads()
+        cv2.setNumThreads(1)
+        q = self._pipeline_queue
+        try:
+            while self._pipeline_running:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                # Frames cross threads, so each gets its own buffer
+                self._put_latest(q, self._preprocess(frame, reuse=False))
+        finally:
+            cv2.setNumThreads(prev_threads)
+            self._pipeline_running = False
+            self._put_latest(q, None)
+    
+    @staticmethod
+    def _put_latest(q, item):
+        # Drop the stale frame if the consumer has not picked it up yet;
+        # only the capture thread puts, so the slot is free afterwards
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            pass
+        q.put_nowait(item)
+    
+    def check_liveness_pipelined(self, timeout=1.0):
+        """Run liveness on the newest frame from start_pipeline, or None when capture ended"""
+        try:
+            gray = self._pipeline_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if gray is None:
+            return None
+        return self.check_liveness(gray, is_gray=True)
+    
+    def stop_pipeline(self):
+        """Stop the background capture thread"""
+        thread = self._pipeline_thread
+        self._pipeline_running = False
+        if thread is not None:
+            thread.join(timeout=1.0)
+        self._pipeline_thread = None
     
     def reset(self):
         """Reset detector"""
         self.blink_counter = 0
         self.total_blinks = 0
         self.frame_count = 0
-        self.start_time = None
+        self._last_rect = None
+        self._frames_since_detect = 0
+        self._ear_smooth = None
+        self._eye_templates = None
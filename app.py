@@ -1,22 +1,32 @@
 
 import os
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+import functools
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session, Response, stream_with_context, g, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from models import db, User, Department, Subject, Student, ClassSession, Attendance
-from utils import ensure_instance_dirs
+from utils import utcnow, ensure_instance_dirs, make_progress_store, list_subdirs, list_jpgs, count_jpgs, AttemptLimiter
 from face_pipeline import FacePipeline
 from datetime import datetime, date, timedelta
-import pandas as pd
 import io
+import csv
 import time
 import threading
-from gpu_setup import setup_gpu, force_cpu
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from gpu_setup import init_gpu
 import json
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
 from markupsafe import escape
-from sqlalchemy import func
+from sqlalchemy import func, event, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload, joinedload, contains_eager
+
+# Optional WebSocket channel for the attendance camera stream
+try:
+    from flask_socketio import SocketIO, emit
+except ImportError:
+    SocketIO = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,12 +36,14 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 INSTANCE_DIR = os.path.join(BASE_DIR, 'instance')
 UPLOAD_DIR = os.path.join(INSTANCE_DIR, 'uploads')
 ENC_DIR = os.path.join(INSTANCE_DIR, 'encodings')
+TRASH_DIR = os.path.join(INSTANCE_DIR, '.trash')
 
 ensure_instance_dirs([INSTANCE_DIR, UPLOAD_DIR, ENC_DIR])
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(INSTANCE_DIR, 'app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 10, 'max_overflow': 20, 'pool_pre_ping': True, 'pool_recycle': 1800}
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')  
 
 db.init_app(app)
@@ -40,14 +52,53 @@ login_manager = LoginManager()
 login_manager.login_view = 'index'
 login_manager.init_app(app)
 
+socketio = SocketIO(app, async_mode='threading') if SocketIO is not None else None
+
+# Configure the GPU before any model is loaded; memory growth can't change afterwards
+USE_GPU = init_gpu()
 face_pipe = FacePipeline(enc_dir=ENC_DIR, upload_dir=UPLOAD_DIR)
 
 # Training progress tracking
-training_progress = {}
+training_progress = make_progress_store()
+
+# Failed password checks per account; a locked-out account skips the hash check entirely
+password_attempts = AttemptLimiter(max_attempts=5, window=300)
+TOO_MANY_ATTEMPTS = 'Too many failed attempts. Please try again in a few minutes.'
+
+def _sqlite_pragmas(dbapi_conn, _):
+    # WAL lets status polls read while training/attendance writes
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA cache_size=-20000")
+    cur.close()
 
 # Create DB on first run
 with app.app_context():
+    event.listen(db.engine, 'connect', _sqlite_pragmas)
     db.create_all()
+    # create_all skips existing tables, so add any indexes they are missing
+    with db.engine.begin() as conn:
+        if not any(ix['name'] == 'ix_att_sess_stu' for ix in inspect(conn).get_indexes('attendance')):
+            # Old databases can hold duplicate (session, student) rows, which would block the
+            # unique index attendance marking relies on; keep the first row of each pair
+            removed = conn.execute(text(
+                "DELETE FROM attendance WHERE id NOT IN "
+                "(SELECT MIN(id) FROM attendance GROUP BY class_session_id, student_id)")).rowcount
+            if removed:
+                logger.warning(f"Removed {removed} duplicate attendance rows before indexing")
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                logger.warning(f"Could not create index {index.name}: {e}")
+    # ON CONFLICT needs the unique index; without it attendance falls back to check-then-insert
+    attendance_upsert_ok = any(ix['name'] == 'ix_att_sess_stu'
+                               for ix in inspect(db.engine).get_indexes('attendance'))
+    if not attendance_upsert_ok:
+        logger.warning("ix_att_sess_stu is missing; marking attendance without ON CONFLICT")
 
 @app.context_processor
 def inject_datetime():
@@ -77,13 +128,275 @@ def safe_text(s, maxlen=500):
         s = s[:maxlen]
     return escape(s)
 
+def get_fields(source, *names, maxlen=500):
+    """Stripped, length-capped values for names from a form or JSON dict
+
+    Pass maxlen=None for passwords - they must reach the hash check verbatim.
+    """
+    out = {}
+    for n in names:
+        v = source.get(n)
+        out[n] = str(v).strip()[:maxlen] if v is not None else ''
+    return out
+
+def training_progress_callback(subject_id):
+    """progress_cb for FacePipeline.train_subject_optimized that feeds training_progress"""
+    def cb(i, total, roll):
+        training_progress.update(subject_id, {
+            'progress': int(i / total * 90),
+            'current_student': f'Processing {roll}...',
+            'students_processed': i,
+            'total_students': total,
+            'status': f'Processing student {i+1}/{total}: {roll}'
+        })
+    return cb
+
+def training_event_stream(subject_id):
+    """Server-sent events carrying training progress until the job is done"""
+    def generate():
+        version, last = 0, None
+        while True:
+            version, info = training_progress.wait(subject_id, version)
+            info = info or {'progress': 0, 'status': 'Not started', 'done': False}
+            if info == last:
+                yield ': keep-alive\n\n'
+                continue
+            last = info
+            yield f"data: {json.dumps(info)}\n\n"
+            if info.get('done'):
+                return
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+STUDENTS_PER_PAGE = 50
+
+def paginate_students(subject_id):
+    """One page of a subject's roster, ordered by roll, page taken from ?page="""
+    page = request.args.get('page', 1, type=int)
+    return (Student.query.filter_by(subject_id=subject_id)
+            .order_by(Student.roll)
+            .paginate(page=page, per_page=STUDENTS_PER_PAGE, error_out=False))
+
+def role_required(model, api=False):
+    """Allow only a logged-in model instance (Department, User or Student), stored on g.user"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            user = current_user._get_current_object()
+            if not isinstance(user, model):
+                if api:
+                    return jsonify({'status': 'error', 'error': 'Access denied', 'message': 'Access denied'}), 403
+                flash('Access denied.', 'danger')
+                return redirect(url_for('index'))
+            g.user = user
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def prof_subject_required(api=False):
+    """Resolve subject_id to a Subject the logged-in professor owns, stored on g.subject"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(subject_id, *args, **kwargs):
+            user = current_user._get_current_object()
+            if not isinstance(user, User):
+                if api:
+                    return jsonify({'status': 'error', 'error': 'Access denied', 'message': 'Access denied'}), 403
+                flash('Access denied.', 'danger')
+                return redirect(url_for('index'))
+            subj = db.session.get(Subject, subject_id)
+            if subj is None:
+                abort(404)
+            if subj.professor_id != user.id:
+                if api:
+                    return jsonify({'status': 'error', 'error': 'Not your subject', 'message': 'Not your subject'}), 403
+                flash('Not authorized.', 'danger')
+                return redirect(url_for('prof_dashboard'))
+            g.user = user
+            g.subject = subj
+            return fn(subject_id, *args, **kwargs)
+        return wrapper
+    return decorator
+
+# Recognition caches - roll lookup per subject and the student ids already
+# marked per session / per subject-day, so recognize_frame dedupes in memory.
+# Request and Socket.IO threads share them, so every lookup, seed, evict and
+# invalidate holds _recognition_cache_lock. Invalidation is per-process: the
+# caches are only correct with a single worker process.
+_subject_student_cache = {}
+_session_marked = {}
+_day_marked = {}
+_MARKED_CACHE_CAP = 256
+_recognition_cache_lock = threading.Lock()
+
+def subject_students_by_roll(subject_id):
+    """Map roll.lower() -> (id, name) for a subject, loaded once and cached"""
+    with _recognition_cache_lock:
+        students = _subject_student_cache.get(subject_id)
+        if students is None:
+            rows = Student.query.with_entities(Student.id, Student.name, Student.roll) \
+                .filter_by(subject_id=subject_id).all()
+            students = {r.roll.lower(): (r.id, r.name) for r in rows}
+            _subject_student_cache[subject_id] = students
+        return students
+
+def session_marked_ids(session_id):
+    with _recognition_cache_lock:
+        marked = _session_marked.get(session_id)
+        if marked is None:
+            if len(_session_marked) >= _MARKED_CACHE_CAP:
+                _session_marked.clear()
+            marked = {sid for (sid,) in db.session.query(Attendance.student_id)
+                      .filter(Attendance.class_session_id == session_id).all()}
+            _session_marked[session_id] = marked
+        return marked
+
+def day_marked_ids(subject_id, day):
+    key = (subject_id, day)
+    with _recognition_cache_lock:
+        marked = _day_marked.get(key)
+        if marked is None:
+            # Drop earlier days so the cache only ever holds today's subjects
+            for k in [k for k in _day_marked if k[1] != day]:
+                del _day_marked[k]
+            marked = {sid for (sid,) in db.session.query(Attendance.student_id)
+                      .join(ClassSession, ClassSession.id == Attendance.class_session_id)
+                      .filter(ClassSession.subject_id == subject_id, ClassSession.date == day).all()}
+            _day_marked[key] = marked
+        return marked
+
+def insert_attendance_once(**values):
+    """INSERT ... ON CONFLICT DO NOTHING on (class_session_id, student_id); True if a row was added"""
+    if not attendance_upsert_ok:
+        exists = db.session.query(Attendance.query.filter_by(
+            class_session_id=values['class_session_id'], student_id=values['student_id']).exists()).scalar()
+        if exists:
+            return False
+        db.session.add(Attendance(**values))
+        return True
+    stmt = sqlite_insert(Attendance).values(**values).on_conflict_do_nothing(
+        index_elements=['class_session_id', 'student_id'])
+    return db.session.execute(stmt).rowcount > 0
+
+def invalidate_recognition_cache(subject_id=None):
+    """Forget cached rolls and marked sets after students or attendance are deleted"""
+    with _recognition_cache_lock:
+        if subject_id is None:
+            _subject_student_cache.clear()
+        else:
+            _subject_student_cache.pop(subject_id, None)
+        _session_marked.clear()
+        _day_marked.clear()
+
+# Training runs one job at a time so concurrent requests don't fight over the GPU
+train_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='train')
+training_jobs = {}
+training_jobs_lock = threading.Lock()
+
+def training_running(subject_id):
+    job = training_jobs.get(subject_id)
+    return job is not None and not job.done()
+
+def submit_training(subject_id, fn):
+    """Queue fn on the training pool unless this subject already has a job in flight"""
+    with training_jobs_lock:
+        if training_running(subject_id):
+            return False
+        for sid in [sid for sid, job in training_jobs.items() if job.done()]:
+            del training_jobs[sid]
+        training_jobs[subject_id] = train_executor.submit(fn)
+        return True
+
+# PDF reports render off the request thread; one job per student at a time
+report_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='report')
+report_jobs = {}  # student id -> (future, monotonic submit time)
+report_jobs_lock = threading.Lock()
+REPORT_WAIT_SECONDS = 2
+# A finished report nobody collected is rebuilt after this, so it never serves stale attendance
+REPORT_JOB_TTL_SECONDS = 60
+
+# Background pool for deleting image folders off the request thread
+cleanup_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='cleanup')
+
+def remove_folders(folders):
+    """Move folders into TRASH_DIR and delete them in the background
+    
+    The rename is atomic, so a re-added student never sees half-deleted
+    images; the slow recursive delete runs on cleanup_executor.
+    """
+    for folder in folders:
+        if not os.path.exists(folder):
+            continue
+        target = folder
+        try:
+            os.makedirs(TRASH_DIR, exist_ok=True)
+            target = os.path.join(TRASH_DIR, uuid.uuid4().hex)
+            os.replace(folder, target)
+        except OSError:
+            target = folder
+        cleanup_executor.submit(shutil.rmtree, target, True)
+
+@functools.lru_cache(maxsize=1024)
+def _count_images_cached(image_dir, mtime_ns):
+    return count_jpgs(image_dir)
+
+def count_images(image_dir):
+    """Count .jpg files in a directory, cached until the directory changes"""
+    try:
+        mtime_ns = os.stat(image_dir).st_mtime_ns
+    except OSError:
+        return 0
+    return _count_images_cached(image_dir, mtime_ns)
+
+def subject_image_counts(subject_id):
+    """Map roll -> image count for every student folder of a subject in one directory walk"""
+    base = os.path.join(UPLOAD_DIR, str(subject_id))
+    try:
+        with os.scandir(base) as it:
+            return {d.name: count_images(d.path) for d in it if d.is_dir()}
+    except FileNotFoundError:
+        return {}
+
+# Department dropdown cache - a short TTL plus a generation counter bumped
+# whenever departments change
+DROPDOWN_TTL_SECONDS = 30
+_department_generation = 0
+
+@functools.lru_cache(maxsize=4)
+def _list_departments_cached(generation, bucket):
+    return Department.query.with_entities(Department.id, Department.name).order_by(Department.name).all()
+
+def list_departments():
+    """Departments (id, name) for login dropdowns, cached for DROPDOWN_TTL_SECONDS"""
+    return _list_departments_cached(_department_generation, int(time.time() // DROPDOWN_TTL_SECONDS))
+
+def invalidate_department_cache():
+    global _department_generation
+    _department_generation += 1
+    _list_departments_cached.cache_clear()
+
+# Classes held per subject for student dashboards; only changes when a
+# session is created or deleted, so cache it with the same TTL + generation scheme
+CLASS_COUNT_TTL_SECONDS = 300
+_class_count_generation = 0
+
+@functools.lru_cache(maxsize=1024)
+def _total_classes_cached(subject_id, generation, bucket):
+    return ClassSession.query.filter_by(subject_id=subject_id).count()
+
+def total_classes_for(subject_id):
+    """Number of class sessions held for subject_id, cached for CLASS_COUNT_TTL_SECONDS"""
+    return _total_classes_cached(subject_id, _class_count_generation, int(time.time() // CLASS_COUNT_TTL_SECONDS))
+
+def invalidate_class_counts():
+    global _class_count_generation
+    _class_count_generation += 1
+    _total_classes_cached.cache_clear()
+
 # Template filter for image count
 
 @app.template_filter('get_image_count')
 def get_image_count(student_or_roll, subject_id):
-    import os
-    from glob import glob
-    
     # Handle both Student objects and roll strings
     if hasattr(student_or_roll, 'roll'):
         # If it's a Student object, get the roll
@@ -92,10 +405,8 @@ def get_image_count(student_or_roll, subject_id):
         # If it's already a roll string, use it directly
         roll = student_or_roll
     
-    image_dir = os.path.join('instance', 'uploads', str(subject_id), str(roll))
-    if os.path.exists(image_dir):
-        return len(glob(os.path.join(image_dir, '*.jpg')))
-    return 0
+    image_dir = os.path.join(UPLOAD_DIR, str(subject_id), str(roll))
+    return count_images(image_dir)
 
 # ---------- Public pages ----------
 @app.route('/')
@@ -108,8 +419,8 @@ def index():
 @app.route('/department/register', methods=['GET', 'POST'])
 def register_department():
     if request.method == 'POST':
-        name = request.form.get('name', '').strip()
-        password = request.form.get('password', '').strip()
+        f = get_fields(request.form, 'name', 'password', maxlen=None)
+        name, password = f['name'], f['password']
 
         if not name or not password:
             flash('Department name and password are required.', 'danger')
@@ -123,6 +434,7 @@ def register_department():
         dept.set_password(password)
         db.session.add(dept)
         db.session.commit()
+        invalidate_department_cache()
 
         flash('Department registered successfully. You can now log in.', 'success')
         return redirect(url_for('login_department'))
@@ -132,19 +444,26 @@ def register_department():
 @app.route('/department/login', methods=['GET', 'POST'])
 def login_department():
     # Get all departments for the dropdown
-    all_departments = Department.query.all()
+    all_departments = list_departments()
     
     if request.method == 'POST':
-        name = request.form.get('name', '').strip()
-        password = request.form.get('password', '').strip()
+        f = get_fields(request.form, 'name', 'password', maxlen=None)
+        name, password = f['name'], f['password']
 
         # Case-insensitive department lookup
         dept = Department.query.filter(Department.name.ilike(name)).first()
-        if dept and dept.check_password(password):
+        key = dept.get_id() if dept else None
+        if key and password_attempts.blocked(key):
+            flash(TOO_MANY_ATTEMPTS, 'danger')
+        elif dept and dept.check_password(password):
+            password_attempts.reset(key)
             login_user(dept)
             flash(f'Welcome {dept.name} Department!', 'success')
             return redirect(url_for('department_dashboard'))
-        flash('Invalid credentials.', 'danger')
+        else:
+            if key:
+                password_attempts.fail(key)
+            flash('Invalid credentials.', 'danger')
     
     return render_template('login_department.html', departments=all_departments)
 
@@ -157,40 +476,63 @@ def department_logout():
 
 @app.route('/department/dashboard')
 @login_required
+@role_required(Department)
 def department_dashboard():
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-
-    subjects = Subject.query.filter_by(department_id=current_user.id).all()
-    professors = User.query.filter_by(department_id=current_user.id).all()
-
-    prof_stats = []
-    for prof in professors:
-        subj_count = Subject.query.filter_by(professor_id=prof.id).count()
-        class_count = ClassSession.query.join(Subject).filter(Subject.professor_id == prof.id).count()
-        prof_stats.append({
-            'prof': prof,
-            'subjects': subj_count,
-            'classes': class_count
-        })
+    # Read-only rows carrying just the columns the template shows
+    subjects = (db.session.query(Subject.id, Subject.name, Subject.professor_id,
+                                 User.username.label('professor_name'),
+                                 User.prof_id.label('professor_prof_id'),
+                                 func.count(Student.id).label('student_count'))
+                .outerjoin(User, User.id == Subject.professor_id)
+                .outerjoin(Student, Student.subject_id == Subject.id)
+                .filter(Subject.department_id == current_user.id)
+                .group_by(Subject.id)
+                .all())
+    professors = (User.query.with_entities(User.id, User.username, User.prof_id)
+                  .filter_by(department_id=current_user.id).all())
+
+    image_counts = {subj.id: subject_image_counts(subj.id) for subj in subjects}
+    if not professors:
+        # Fresh department - nothing to aggregate per professor
+        return render_template('department_dashboard.html',
+                               department=current_user,
+                               subjects=subjects,
+                               professors=[],
+                               prof_stats=[],
+                               image_counts=image_counts)
+
+    # Per-professor subject and class counts in one grouped query each
+    subj_counts = {}
+    class_counts = {}
+    if subjects:
+        subj_counts = dict(db.session.query(Subject.professor_id, func.count(Subject.id))
+                           .filter(Subject.department_id == current_user.id)
+                           .group_by(Subject.professor_id).all())
+        class_counts = dict(db.session.query(Subject.professor_id, func.count(ClassSession.id))
+                            .join(ClassSession, ClassSession.subject_id == Subject.id)
+                            .filter(Subject.department_id == current_user.id)
+                            .group_by(Subject.professor_id).all())
+
+    prof_stats = [{
+        'prof': prof,
+        'subjects': subj_counts.get(prof.id, 0),
+        'classes': class_counts.get(prof.id, 0)
+    } for prof in professors]
 
     return render_template('department_dashboard.html',
                            department=current_user,
                            subjects=subjects,
                            professors=professors,
-                           prof_stats=prof_stats)
+                           prof_stats=prof_stats,
+                           image_counts=image_counts)
 
 @app.route('/department/add_professor', methods=['POST'])
 @login_required
+@role_required(Department)
 def department_add_professor():
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-
-    name = request.form.get('name', '').strip()
-    prof_id = request.form.get('prof_id', '').strip()
-    temp_password = request.form.get('temp_password', '').strip()  
+    f = get_fields(request.form, 'name', 'prof_id')
+    name, prof_id = f['name'], f['prof_id']
+    temp_password = get_fields(request.form, 'temp_password', maxlen=None)['temp_password']
 
     if not name or not prof_id or not temp_password:  
         flash('Professor name, ID and temporary password are required.', 'danger')
@@ -211,13 +553,10 @@ def department_add_professor():
 
 @app.route('/department/add_subject', methods=['POST'])
 @login_required
+@role_required(Department)
 def department_add_subject():
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-
-    name = request.form.get('name', '').strip()
-    prof_id = request.form.get('prof_id', '').strip()
+    f = get_fields(request.form, 'name', 'prof_id')
+    name, prof_id = f['name'], f['prof_id']
 
     if not name:
         flash('Subject name is required.', 'danger')
@@ -238,12 +577,9 @@ def department_add_subject():
 
 @app.route('/department/delete_professor/<int:prof_id>', methods=['POST'])
 @login_required
+@role_required(Department)
 def delete_professor(prof_id):
     """Delete a professor and ALL associated data"""
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
     prof = User.query.get_or_404(prof_id)
     
     # Verify the professor belongs to the current department
@@ -265,38 +601,28 @@ def delete_professor(prof_id):
         if recent_sessions > 0:
             flash(f'Warning: Professor {professor_name} has conducted {recent_sessions} class sessions. All data will be deleted.', 'warning')
         
-        # 1. Get all subjects taught by this professor
-        subjects_taught = Subject.query.filter_by(professor_id=prof.id).all()
+        # 1. Get all subjects taught by this professor and their students
+        subject_ids = [sid for (sid,) in Subject.query.with_entities(Subject.id).filter_by(professor_id=prof.id).all()]
+        students = Student.query.with_entities(Student.id, Student.subject_id, Student.roll).filter(
+            Student.subject_id.in_(subject_ids)
+        ).all()
+        student_ids = [st.id for st in students]
         
-        # 2. For each subject, delete all students and their data
-        students_deleted = 0
-        for subject in subjects_taught:
-            # Delete all students in this subject
-            students_in_subject = Student.query.filter_by(subject_id=subject.id).all()
-            
-            for student in students_in_subject:
-                # Delete student images
-                folder = os.path.join('instance', 'uploads', str(subject.id), student.roll)
-                if os.path.exists(folder):
-                    import shutil
-                    shutil.rmtree(folder, ignore_errors=True)
-                
-                # Delete attendance records
-                Attendance.query.filter_by(student_id=student.id).delete()
-                
-                # Delete the student
-                db.session.delete(student)
-                students_deleted += 1
-            
-            # Delete class sessions for this subject
-            ClassSession.query.filter_by(subject_id=subject.id).delete()
-            
-            # Delete the subject itself
-            db.session.delete(subject)
+        # 2. Delete student images
+        remove_folders([os.path.join(UPLOAD_DIR, str(st.subject_id), st.roll) for st in students])
         
-        # 3. Delete the professor
+        # 3. Bulk delete attendance, students, class sessions and subjects
+        Attendance.query.filter(Attendance.student_id.in_(student_ids)).delete(synchronize_session=False)
+        Student.query.filter(Student.id.in_(student_ids)).delete(synchronize_session=False)
+        ClassSession.query.filter(ClassSession.subject_id.in_(subject_ids)).delete(synchronize_session=False)
+        Subject.query.filter(Subject.id.in_(subject_ids)).delete(synchronize_session=False)
+        students_deleted = len(student_ids)
+        
+        # 4. Delete the professor
         db.session.delete(prof)
         db.session.commit()
+        invalidate_recognition_cache()
+        invalidate_class_counts()
         
         flash(f'Professor {professor_name} deleted successfully. Removed {subject_count} subjects and {students_deleted} students with all their data.', 'success')
         
@@ -308,12 +634,9 @@ def delete_professor(prof_id):
 
 @app.route('/department/subject/<int:subject_id>/assign_professor', methods=['POST'])
 @login_required
+@role_required(Department)
 def assign_professor_to_subject(subject_id):
     """Assign a professor to a subject"""
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
     subject = Subject.query.get_or_404(subject_id)
     
     # Verify the subject belongs to the current department
@@ -343,12 +666,9 @@ def assign_professor_to_subject(subject_id):
 
 @app.route('/department/subject/<int:subject_id>/remove_professor', methods=['POST'])
 @login_required
+@role_required(Department)
 def remove_professor_from_subject(subject_id):
     """Remove professor assignment from a subject"""
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
     subject = Subject.query.get_or_404(subject_id)
     
     # Verify the subject belongs to the current department
@@ -370,12 +690,9 @@ def remove_professor_from_subject(subject_id):
 
 @app.route('/department/delete_subject/<int:subject_id>', methods=['POST'])
 @login_required
+@role_required(Department)
 def delete_subject(subject_id):
     """Delete a subject and ALL associated data"""
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
     subject = Subject.query.get_or_404(subject_id)
     
     # Verify the subject belongs to the current department
@@ -387,29 +704,24 @@ def delete_subject(subject_id):
     
     try:
         #  Delete all students in this subject and their data
-        students_in_subject = Student.query.filter_by(subject_id=subject.id).all()
-        students_deleted = 0
+        students = Student.query.with_entities(Student.id, Student.roll).filter_by(subject_id=subject.id).all()
+        student_ids = [st.id for st in students]
         
-        for student in students_in_subject:
-            # Delete student images
-            folder = os.path.join('instance', 'uploads', str(subject.id), student.roll)
-            if os.path.exists(folder):
-                import shutil
-                shutil.rmtree(folder, ignore_errors=True)
-            
-            # Delete attendance records
-            Attendance.query.filter_by(student_id=student.id).delete()
-            
-            # Delete the student
-            db.session.delete(student)
-            students_deleted += 1
+        # Delete student images
+        remove_folders([os.path.join(UPLOAD_DIR, str(subject.id), st.roll) for st in students])
+        
+        # Bulk delete attendance records and students
+        Attendance.query.filter(Attendance.student_id.in_(student_ids)).delete(synchronize_session=False)
+        students_deleted = Student.query.filter(Student.id.in_(student_ids)).delete(synchronize_session=False)
         
         # 2. Delete class sessions for this subject
-        sessions_deleted = ClassSession.query.filter_by(subject_id=subject.id).delete()
+        sessions_deleted = ClassSession.query.filter_by(subject_id=subject.id).delete(synchronize_session=False)
         
         # 3. Delete the subject itself
         db.session.delete(subject)
         db.session.commit()
+        invalidate_recognition_cache(subject_id)
+        invalidate_class_counts()
         
         flash(f'Subject "{subject_name}" deleted successfully. Removed {students_deleted} students and {sessions_deleted} class sessions.', 'success')
         
@@ -422,23 +734,39 @@ def delete_subject(subject_id):
 
 @app.route('/department/analytics')
 @login_required
+@role_required(Department)
 def department_analytics():
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-
     department = current_user
     subjects = Subject.query.filter_by(department_id=department.id).all()
     analytics = []
 
+    subject_ids = [subj.id for subj in subjects]
+    if not subject_ids:
+        return render_template('department_analytics.html',
+                               department=department,
+                               analytics=analytics)
+
+    # Class totals per subject and attendance per (subject, student), one query each
+    totals = dict(db.session.query(ClassSession.subject_id, func.count(ClassSession.id))
+                  .filter(ClassSession.subject_id.in_(subject_ids))
+                  .group_by(ClassSession.subject_id).all())
+    attended_counts = {
+        (subject_id, student_id): count
+        for subject_id, student_id, count in db.session.query(
+            ClassSession.subject_id, Attendance.student_id, func.count(Attendance.id))
+        .join(Attendance, Attendance.class_session_id == ClassSession.id)
+        .filter(ClassSession.subject_id.in_(subject_ids))
+        .group_by(ClassSession.subject_id, Attendance.student_id).all()
+    }
+
+    students_by_subject = {}
+    for st in Student.query.filter(Student.subject_id.in_(subject_ids)).order_by(Student.id).all():
+        students_by_subject.setdefault(st.subject_id, []).append(st)
+
     for subj in subjects:
-        total_classes = ClassSession.query.filter_by(subject_id=subj.id).count()
-        students = Student.query.filter_by(subject_id=subj.id).all()
-        for st in students:
-            attended = Attendance.query.join(ClassSession).filter(
-                Attendance.student_id == st.id,
-                ClassSession.subject_id == subj.id
-            ).count()
+        total_classes = totals.get(subj.id, 0)
+        for st in students_by_subject.get(subj.id, []):
+            attended = attended_counts.get((subj.id, st.id), 0)
             perc = (attended / total_classes * 100) if total_classes > 0 else 0
             eligible = perc >= 75 or getattr(st, "eligible_override", False)
             analytics.append({
@@ -456,11 +784,8 @@ def department_analytics():
 
 @app.route('/department/override/<int:student_id>', methods=['POST'])
 @login_required
+@role_required(Department)
 def override_student_eligibility(student_id):
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-
     st = Student.query.get_or_404(student_id)
     if st.department_id != current_user.id:
         flash('Student does not belong to your department.', 'danger')
@@ -475,37 +800,32 @@ def override_student_eligibility(student_id):
 
 @app.route('/department/subject/<int:subject_id>/students')
 @login_required
+@role_required(Department)
 def department_manage_students(subject_id):
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
     subj = Subject.query.get_or_404(subject_id)
     if subj.department_id != current_user.id:
         flash('Not authorized.', 'danger')
         return redirect(url_for('department_dashboard'))
     
-    students = Student.query.filter_by(subject_id=subj.id).all()
+    pagination = paginate_students(subj.id)
     return render_template('department_manage_students.html', 
                          subject=subj, 
-                         students=students,
+                         students=pagination.items,
+                         pagination=pagination,
+                         image_counts=subject_image_counts(subj.id),
                          department=current_user)
 
 @app.route('/department/subject/<int:subject_id>/add_student', methods=['POST'])
 @login_required
+@role_required(Department, api=True)
 def department_add_student(subject_id):
-    if not isinstance(current_user, Department):
-        return jsonify({'status':'error','message':'Access denied'}), 403
-    
     subj = Subject.query.get_or_404(subject_id)
     if subj.department_id != current_user.id:
         return jsonify({'status':'error','message':'Not authorized'}), 403
 
     data = request.get_json(force=True)
-    name = data.get('name','').strip()
-    roll = data.get('roll','').strip()
-    branch = data.get('branch','').strip()
-    course = data.get('course','').strip()
+    f = get_fields(data, 'name', 'roll', 'branch', 'course')
+    name, roll, branch, course = f['name'], f['roll'], f['branch'], f['course']
 
     if not name or not roll:
         return jsonify({'status':'error','message':'Missing fields'}), 400
@@ -526,14 +846,13 @@ def department_add_student(subject_id):
                       department_id=current_user.id)
     db.session.add(student)
     db.session.commit()
+    invalidate_recognition_cache(subject_id)
     return jsonify({'status':'ok','student_id': student.id})
 
 @app.route('/department/subject/<int:subject_id>/capture_photo', methods=['POST'])
 @login_required
+@role_required(Department, api=True)
 def department_capture_photo(subject_id):
-    if not isinstance(current_user, Department):
-        return jsonify({'status':'error','message':'Access denied'}), 403
-    
     data = request.get_json(force=True)
     sid = data.get('student_id')
     image_data = data.get('image')
@@ -545,36 +864,28 @@ def department_capture_photo(subject_id):
 
 @app.route('/department/subject/<int:subject_id>/delete_student/<int:student_id>', methods=['POST'])
 @login_required
+@role_required(Department)
 def department_delete_student(subject_id, student_id):
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
     st = Student.query.get_or_404(student_id)
     if st.subject_id != subject_id or st.department_id != current_user.id:
         flash('Not authorized.', 'danger')
         return redirect(url_for('department_manage_students', subject_id=subject_id))
 
     # Delete student images
-    folder = os.path.join('instance', 'uploads', str(subject_id), st.roll)
-    if os.path.exists(folder):
-        import shutil
-        shutil.rmtree(folder, ignore_errors=True)
+    remove_folders([os.path.join(UPLOAD_DIR, str(subject_id), st.roll)])
     
     # Delete attendance records
-    Attendance.query.filter_by(student_id=st.id).delete()
+    Attendance.query.filter_by(student_id=st.id).delete(synchronize_session=False)
     db.session.delete(st)
     db.session.commit()
+    invalidate_recognition_cache(subject_id)
     flash('Student deleted successfully.', 'success')
     return redirect(url_for('department_manage_students', subject_id=subject_id))
 
 @app.route('/department/subject/<int:subject_id>/train')
 @login_required
+@role_required(Department)
 def department_train_model(subject_id):
-    if not isinstance(current_user, Department):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
     subj = Subject.query.get_or_404(subject_id)
     if subj.department_id != current_user.id:
         flash('Not authorized.', 'danger')
@@ -584,15 +895,14 @@ def department_train_model(subject_id):
     return render_template('department_train.html', 
                          subject=subj, 
                          students=students,
+                         image_counts=subject_image_counts(subj.id),
                          department=current_user)
 
 @app.route('/department/subject/<int:subject_id>/train/start', methods=['POST'])
 @login_required
+@role_required(Department, api=True)
 def department_start_training(subject_id):
     """Department version of training"""
-    if not isinstance(current_user, Department):
-        return jsonify({'status': 'error', 'message': 'Access denied'}), 403
-    
     subj = Subject.query.get_or_404(subject_id)
     if subj.department_id != current_user.id:
         return jsonify({'status': 'error', 'message': 'Not authorized'}), 403
@@ -601,6 +911,9 @@ def department_start_training(subject_id):
     data = request.get_json(force=True)
     mode = data.get('mode', 'high_quality')
     
+    if training_running(subject_id):
+        return jsonify({'status': 'already_running', 'subject_id': subject_id})
+    
     # Initialize progress
     training_progress[subject_id] = {
         'progress': 0, 
@@ -614,30 +927,41 @@ def department_start_training(subject_id):
     def run_training():
         try:
             # Same training logic as professor version
-            res = face_pipe.train_subject_optimized(subject_id, mode)
-            training_progress[subject_id].update({
+            res = face_pipe.train_subject_optimized(subject_id, mode,
+                                                    progress_cb=training_progress_callback(subject_id))
+            training_progress.update(subject_id, {
                 'progress': 100,
                 'status': ' Department training complete' if res.get('status') == 'success' else f' Department training failed: {res.get("message", "Unknown error")}',
                 'done': True,
                 'result': res
             })
         except Exception as e:
-            training_progress[subject_id].update({
+            training_progress.update(subject_id, {
                 'progress': 100,
                 'status': f' Department training failed: {str(e)}',
                 'done': True
             })
 
-    t = threading.Thread(target=run_training, daemon=True)
-    t.start()
+    if not submit_training(subject_id, run_training):
+        return jsonify({'status': 'already_running', 'subject_id': subject_id})
     return jsonify({'status': 'started', 'subject_id': subject_id})
 
 @app.route('/department/subject/<int:subject_id>/train/status')
 @login_required
 def department_get_training_status(subject_id):
     info = training_progress.get(subject_id, {'progress': 0, 'status': 'Not started', 'done': False})
+    info['running'] = training_running(subject_id)
     return jsonify(info)
 
+@app.route('/department/subject/<int:subject_id>/train/stream')
+@login_required
+@role_required(Department, api=True)
+def department_training_stream(subject_id):
+    subj = Subject.query.get_or_404(subject_id)
+    if subj.department_id != current_user.id:
+        return jsonify({'status': 'error', 'message': 'Not authorized'}), 403
+    return training_event_stream(subject_id)
+
 # ======== END DEPARTMENT STUDENT MANAGEMENT ROUTES ========
 
 # -------------------------
@@ -647,14 +971,11 @@ def department_get_training_status(subject_id):
 @app.route('/professor/login', methods=['GET','POST'])
 def login_professor():
    
-    all_departments = Department.query.all()
-    all_professors = User.query.all()
+    all_departments = list_departments()
     
     if request.method == 'POST':
-        dept_name = request.form.get('department','').strip()
-        prof_id = request.form.get('prof_id','').strip()
-        username = request.form.get('username','').strip()
-        password = request.form.get('password','').strip()
+        f = get_fields(request.form, 'department', 'prof_id', 'username', 'password', maxlen=None)
+        dept_name, prof_id, username, password = f['department'], f['prof_id'], f['username'], f['password']
 
         
         dept = Department.query.filter(Department.name.ilike(dept_name)).first()
@@ -676,7 +997,13 @@ def login_professor():
             flash('Professor name does not match.', 'danger')
             return redirect(url_for('login_professor'))
 
+        key = prof.get_id()
+        if password_attempts.blocked(key):
+            flash(TOO_MANY_ATTEMPTS, 'danger')
+            return redirect(url_for('login_professor'))
+
         if prof.check_password(password):
+            password_attempts.reset(key)
             login_user(prof)
             
             # Check if password change is required
@@ -687,11 +1014,17 @@ def login_professor():
                 flash('Welcome Professor!', 'success')
                 return redirect(url_for('prof_dashboard'))
         else:
+            password_attempts.fail(key)
             flash('Invalid credentials.', 'danger')
 
     return render_template('login_professor.html', 
-                         departments=all_departments, 
-                         professors=all_professors)
+                         departments=all_departments)
+
+@app.route('/professor/list/<int:dept_id>')
+def list_professors(dept_id):
+    """Professor IDs and names for the login dropdown of one department"""
+    profs = User.query.with_entities(User.prof_id, User.username).filter_by(department_id=dept_id).all()
+    return jsonify([{'prof_id': p.prof_id, 'username': p.username} for p in profs])
 
 @app.route('/prof/logout')
 @login_required
@@ -702,12 +1035,14 @@ def prof_logout():
 
 @app.route('/professor/dashboard')
 @login_required
+@role_required(User)
 def prof_dashboard():
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
-    subjects = Subject.query.filter_by(professor_id=current_user.id).all()
+    # Students and sessions are used for the stats and by the template, so
+    # load them up front with one IN query per relationship
+    subjects = Subject.query.options(
+        selectinload(Subject.students),
+        selectinload(Subject.sessions)
+    ).filter_by(professor_id=current_user.id).all()
     
     # Calculate all stats in Python
     total_students = sum(len(subject.students) for subject in subjects)
@@ -723,45 +1058,32 @@ def prof_dashboard():
 # Student Management 
 @app.route('/prof/<int:subject_id>/students/add')
 @login_required
+@prof_subject_required()
 def add_student_page(subject_id):
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        flash('Not authorized.', 'danger')
-        return redirect(url_for('prof_dashboard'))
-    students = Student.query.filter_by(subject_id=subj.id).all()
-    return render_template('register_student.html', subject=subj, students=students)
+    subj = g.subject
+    pagination = paginate_students(subj.id)
+    return render_template('register_student.html', subject=subj, students=pagination.items,
+                           pagination=pagination, image_counts=subject_image_counts(subj.id))
 
 @app.route('/prof/<int:subject_id>/students')
 @login_required
+@prof_subject_required()
 def students_page(subject_id):
     """Main students management page"""
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        flash('Not authorized.', 'danger')
-        return redirect(url_for('prof_dashboard'))
-    students = Student.query.filter_by(subject_id=subj.id).all()
-    return render_template('register_student.html', subject=subj, students=students)
+    subj = g.subject
+    pagination = paginate_students(subj.id)
+    return render_template('register_student.html', subject=subj, students=pagination.items,
+                           pagination=pagination, image_counts=subject_image_counts(subj.id))
 
 @app.route('/prof/<int:subject_id>/add_student', methods=['POST'])
 @login_required
+@prof_subject_required(api=True)
 def add_student(subject_id):
-    if not isinstance(current_user, User):
-        return jsonify({'status':'error','message':'Access denied'}), 403
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        return jsonify({'status':'error','message':'Not your subject'}), 403
+    subj = g.subject
 
     data = request.get_json(force=True)
-    name = data.get('name','').strip()
-    roll = data.get('roll','').strip()
-    branch = data.get('branch','').strip()
-    course = data.get('course','').strip()
+    f = get_fields(data, 'name', 'roll', 'branch', 'course')
+    name, roll, branch, course = f['name'], f['roll'], f['branch'], f['course']
 
     if not name or not roll:
         return jsonify({'status':'error','message':'Missing fields'}), 400
@@ -781,29 +1103,26 @@ def add_student(subject_id):
                       department_id=current_user.department_id)
     db.session.add(student)
     db.session.commit()
+    invalidate_recognition_cache(subject_id)
     return jsonify({'status':'ok','student_id': student.id})
 
 @app.route('/prof/<int:subject_id>/delete_student/<int:student_id>', methods=['POST'])
 @login_required
+@prof_subject_required()
 def delete_student(subject_id, student_id):
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
     st = Student.query.get_or_404(student_id)
     if st.subject_id != subject_id or st.professor_id != current_user.id:
         flash('Not authorized.', 'danger')
         return redirect(url_for('add_student_page', subject_id=subject_id))
 
     # Delete student images
-    folder = os.path.join('instance', 'uploads', str(subject_id), st.roll)
-    if os.path.exists(folder):
-        import shutil
-        shutil.rmtree(folder, ignore_errors=True)
+    remove_folders([os.path.join(UPLOAD_DIR, str(subject_id), st.roll)])
     
     # Delete attendance records
-    Attendance.query.filter_by(student_id=st.id).delete()
+    Attendance.query.filter_by(student_id=st.id).delete(synchronize_session=False)
     db.session.delete(st)
     db.session.commit()
+    invalidate_recognition_cache(subject_id)
     flash('Student deleted successfully.', 'success')
     return redirect(url_for('add_student_page', subject_id=subject_id))
 
@@ -815,9 +1134,8 @@ def manage_students(subject_id):
 # Image Capture
 @app.route('/prof/<int:subject_id>/capture_photo', methods=['POST'])
 @login_required
+@prof_subject_required(api=True)
 def capture_photo(subject_id):
-    if not isinstance(current_user, User):
-        return jsonify({'status':'error','message':'Access denied'}), 403
     data = request.get_json(force=True)
     sid = data.get('student_id')
     image_data = data.get('image')
@@ -830,28 +1148,21 @@ def capture_photo(subject_id):
 # Training
 @app.route('/prof/<int:subject_id>/train')
 @login_required
+@prof_subject_required()
 def train_page(subject_id):
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        flash('Not authorized.', 'danger')
-        return redirect(url_for('prof_dashboard'))
+    subj = g.subject
     students = Student.query.filter_by(subject_id=subj.id).all()
-    return render_template('train.html', subject=subj, students=students)
+    return render_template('train.html', subject=subj, students=students,
+                           image_counts=subject_image_counts(subj.id))
 
 @app.route('/prof/<int:subject_id>/train', methods=['POST'])
 @login_required
+@prof_subject_required(api=True)
 def train_subject(subject_id):
-    if not isinstance(current_user, User):
-        return jsonify({'status':'error','message':'Access denied'}), 403
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        return jsonify({'status':'error','message':'Not your subject'}), 403
+    subj = g.subject
     
     # Get training mode from request
-    data = request.get_json(force=True) if request.get_json(force=True) else {}
+    data = request.get_json(force=True, silent=True) or {}
     mode = data.get('mode', 'high_quality')  # high_quality, faster_quality
     
     # This will now use the optimized version
@@ -865,22 +1176,15 @@ def train_subject(subject_id):
 
 @app.route('/prof/<int:subject_id>/train/start', methods=['POST'])
 @login_required
+@prof_subject_required(api=True)
 def start_training(subject_id):
     """Run model training asynchronously with GPU setup"""
-    if not isinstance(current_user, User):
-        return jsonify({'status': 'error', 'message': 'Access denied'}), 403
-
-    # Initialize GPU setup
-    from gpu_setup import setup_gpu, force_cpu
-    
-    # Try GPU first, fallback to CPU
-    use_gpu = setup_gpu()
-    if not use_gpu:
-        force_cpu()
-    
     data = request.get_json(force=True)
     mode = data.get('mode', 'high_quality')
     
+    if training_running(subject_id):
+        return jsonify({'status': 'already_running', 'subject_id': subject_id})
+    
     # Initialize progress with more detailed tracking
     training_progress[subject_id] = {
         'progress': 0, 
@@ -893,40 +1197,10 @@ def start_training(subject_id):
 
     def run_training():
         try:
-            subject_path = os.path.join('instance', 'uploads', str(subject_id))
-            students = [d for d in os.listdir(subject_path) if os.path.isdir(os.path.join(subject_path, d))]
-            total_students = len(students)
-            
-            training_progress[subject_id].update({
-                'total_students': total_students,
-                'status': f'Found {total_students} students to process...'
-            })
-            
-            # Process students with detailed progress
-            successful_students = 0
-            for i, roll in enumerate(students):
-                training_progress[subject_id].update({
-                    'progress': int((i / total_students) * 80),  
-                    'current_student': f'Processing {roll}...',
-                    'students_processed': i,
-                    'status': f'Processing student {i+1}/{total_students}: {roll}'
-                })
-                time.sleep(0.5)  
-                
-                
-                successful_students += 1
-            
-            # Final encoding and saving
-            training_progress[subject_id].update({
-                'progress': 90,
-                'status': 'Saving encodings...'
-            })
-            time.sleep(1)
-            
-            #  actual training
-            res = face_pipe.train_subject_optimized(subject_id, mode)
+            res = face_pipe.train_subject_optimized(subject_id, mode,
+                                                    progress_cb=training_progress_callback(subject_id))
 
-            training_progress[subject_id].update({
+            training_progress.update(subject_id, {
                 'progress': 100,
                 'status': '✅ Training complete' if res.get('status') == 'success' else f'❌ Training failed: {res.get("message", "Unknown error")}',
                 'done': True,
@@ -934,32 +1208,35 @@ def start_training(subject_id):
             })
 
         except Exception as e:
-            training_progress[subject_id].update({
+            training_progress.update(subject_id, {
                 'progress': 100,
                 'status': f'❌ Error: {str(e)}',
                 'done': True
             })
 
-    t = threading.Thread(target=run_training, daemon=True)
-    t.start()
-    return jsonify({'status': 'started', 'subject_id': subject_id, 'using_gpu': use_gpu})
+    if not submit_training(subject_id, run_training):
+        return jsonify({'status': 'already_running', 'subject_id': subject_id})
+    return jsonify({'status': 'started', 'subject_id': subject_id, 'using_gpu': USE_GPU})
 
 @app.route('/prof/<int:subject_id>/train/status')
 @login_required
+@prof_subject_required(api=True)
 def get_training_status(subject_id):
     info = training_progress.get(subject_id, {'progress': 0, 'status': 'Not started', 'done': False})
+    info['running'] = training_running(subject_id)
     return jsonify(info)
 
+@app.route('/prof/<int:subject_id>/train/stream')
+@login_required
+@prof_subject_required(api=True)
+def training_stream(subject_id):
+    return training_event_stream(subject_id)
+
 @app.route('/prof/<int:subject_id>/train_results')
 @login_required
+@prof_subject_required()
 def train_results(subject_id):
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        flash('Not authorized.', 'danger')
-        return redirect(url_for('prof_dashboard'))
+    subj = g.subject
     res = face_pipe.train_report(subject_id)
     return render_template('train_results.html', report=res, subject=subj)
 
@@ -974,15 +1251,13 @@ def debug_training(subject_id):
         return jsonify({'error': 'Subject directory not found'})
     
     students = []
-    for roll in os.listdir(subject_path):
-        roll_path = os.path.join(subject_path, roll)
-        if os.path.isdir(roll_path):
-            images = list(Path(roll_path).glob('*.jpg'))
-            students.append({
-                'roll': roll,
-                'image_count': len(images),
-                'images': [str(img) for img in images[:3]]  # First 3 images
-            })
+    for roll in list_subdirs(subject_path):
+        images = list_jpgs(os.path.join(subject_path, roll))
+        students.append({
+            'roll': roll,
+            'image_count': len(images),
+            'images': images[:3]  # First 3 images
+        })
     
     return jsonify({
         'subject_id': subject_id,
@@ -995,11 +1270,8 @@ def debug_training(subject_id):
 @login_required
 def debug_training_status(subject_id):
     """Check training status and requirements"""
-    import os
-    from pathlib import Path
-    
     subject_path = os.path.join('instance', 'uploads', str(subject_id))
-    enc_path = os.path.join('instance', 'encodings', f'subject_{subject_id}_enc.pkl')
+    enc_path = face_pipe.encoding_path(subject_id)
     
     result = {
         'subject_id': subject_id,
@@ -1010,16 +1282,14 @@ def debug_training_status(subject_id):
     
     if os.path.exists(subject_path):
         students = []
-        for roll in os.listdir(subject_path):
-            roll_path = os.path.join(subject_path, roll)
-            if os.path.isdir(roll_path):
-                images = list(Path(roll_path).glob('*.jpg'))
-                students.append({
-                    'roll': roll,
-                    'image_count': len(images),
-                    'has_enough_images': len(images) >= 8,
-                    'image_files': [img.name for img in images[:3]]  # First 3 filenames
-                })
+        for roll in list_subdirs(subject_path):
+            images = list_jpgs(os.path.join(subject_path, roll))
+            students.append({
+                'roll': roll,
+                'image_count': len(images),
+                'has_enough_images': len(images) >= 8,
+                'image_files': [os.path.basename(img) for img in images[:3]]  # First 3 filenames
+            })
         result['students'] = students
         result['total_students'] = len(students)
         result['ready_for_training'] = len([s for s in students if s['has_enough_images']])
@@ -1028,28 +1298,26 @@ def debug_training_status(subject_id):
 
 @app.route('/debug/attendance/<int:subject_id>/<date>')
 @login_required
+@role_required(User, api=True)
 def debug_attendance_date(subject_id, date):
     """Debug route to check attendance for a specific date"""
-    if not isinstance(current_user, User):
-        return jsonify({'error': 'Access denied'}), 403
-    
     try:
         attendance_date = datetime.strptime(date, '%Y-%m-%d').date()
     except ValueError:
         return jsonify({'error': 'Invalid date format'}), 400
     
     # Find class session for this date
-    session = ClassSession.query.filter_by(
+    class_session = ClassSession.query.filter_by(
         subject_id=subject_id, 
         date=attendance_date
     ).first()
     
-    if not session:
+    if not class_session:
         return jsonify({'error': 'No class session found for this date'})
     
     #  all attendance records for this session
     attendance_records = Attendance.query.filter_by(
-        class_session_id=session.id
+        class_session_id=class_session.id
     ).join(Student).all()
     
     records_data = []
@@ -1069,8 +1337,8 @@ def debug_attendance_date(subject_id, date):
     student_list = [{'id': s.id, 'name': s.name, 'roll': s.roll} for s in all_students]
     
     return jsonify({
-        'session_id': session.id,
-        'date': session.date.isoformat(),
+        'session_id': class_session.id,
+        'date': class_session.date.isoformat(),
         'attendance_records': records_data,
         'total_students_in_subject': len(student_list),
         'all_students': student_list,
@@ -1079,22 +1347,23 @@ def debug_attendance_date(subject_id, date):
 
 @app.route('/debug/calendar_data/<int:subject_id>')
 @login_required
+@role_required(User, api=True)
 def debug_calendar_data(subject_id):
     """Debug route to check calendar data"""
-    if not isinstance(current_user, User):
-        return jsonify({'error': 'Access denied'}), 403
-    
     #  all class sessions
     sessions = ClassSession.query.filter_by(subject_id=subject_id).all()
+    attendance_counts = dict(db.session.query(Attendance.class_session_id, func.count(Attendance.id))
+                             .join(ClassSession, ClassSession.id == Attendance.class_session_id)
+                             .filter(ClassSession.subject_id == subject_id)
+                             .group_by(Attendance.class_session_id).all())
     session_data = []
     
-    for session in sessions:
-        attendance_count = Attendance.query.filter_by(class_session_id=session.id).count()
+    for class_session in sessions:
         session_data.append({
-            'date': session.date.isoformat(),
-            'session_id': session.id,
-            'attendance_records_count': attendance_count,
-            'start_time': session.start_time.isoformat() if session.start_time else None
+            'date': class_session.date.isoformat(),
+            'session_id': class_session.id,
+            'attendance_records_count': attendance_counts.get(class_session.id, 0),
+            'start_time': class_session.start_time.isoformat() if class_session.start_time else None
         })
     
     #  all students
@@ -1111,28 +1380,26 @@ def debug_calendar_data(subject_id):
 
 @app.route('/debug/attendance_db_check/<int:subject_id>/<date>')
 @login_required
+@role_required(User, api=True)
 def debug_attendance_db_check(subject_id, date):
     """Debug route to check database integrity for attendance records"""
-    if not isinstance(current_user, User):
-        return jsonify({'error': 'Access denied'}), 403
-    
     try:
         attendance_date = datetime.strptime(date, '%Y-%m-%d').date()
     except ValueError:
         return jsonify({'error': 'Invalid date format'}), 400
     
     #  class session
-    session = ClassSession.query.filter_by(
+    class_session = ClassSession.query.filter_by(
         subject_id=subject_id, 
         date=attendance_date
     ).first()
     
-    if not session:
+    if not class_session:
         return jsonify({'error': 'No session found'})
     
     #  raw database records
     attendance_records = Attendance.query.filter_by(
-        class_session_id=session.id
+        class_session_id=class_session.id
     ).join(Student).all()
     
     records_data = []
@@ -1153,8 +1420,8 @@ def debug_attendance_db_check(subject_id, date):
     student_list = [{'id': s.id, 'name': s.name, 'roll': s.roll} for s in all_students]
     
     return jsonify({
-        'session_id': session.id,
-        'date': session.date.isoformat(),
+        'session_id': class_session.id,
+        'date': class_session.date.isoformat(),
         'attendance_records_found': len(records_data),
         'total_students_in_subject': len(student_list),
         'attendance_records': records_data,
@@ -1165,28 +1432,26 @@ def debug_attendance_db_check(subject_id, date):
 
 @app.route('/debug/attendance_check/<int:subject_id>/<date>')
 @login_required
+@role_required(User, api=True)
 def debug_attendance_check(subject_id, date):
     """Debug route to check attendance data for a specific date"""
-    if not isinstance(current_user, User):
-        return jsonify({'error': 'Access denied'}), 403
-    
     try:
         attendance_date = datetime.strptime(date, '%Y-%m-%d').date()
     except ValueError:
         return jsonify({'error': 'Invalid date format'}), 400
     
     #  class session
-    session = ClassSession.query.filter_by(
+    class_session = ClassSession.query.filter_by(
         subject_id=subject_id, 
         date=attendance_date
     ).first()
     
-    if not session:
+    if not class_session:
         return jsonify({'error': 'No session found for this date'})
     
     #  all attendance records for this session
     attendance_records = Attendance.query.filter_by(
-        class_session_id=session.id
+        class_session_id=class_session.id
     ).join(Student).all()
     
     # all students in the subject
@@ -1206,8 +1471,8 @@ def debug_attendance_check(subject_id, date):
     all_students_data = [{'id': s.id, 'name': s.name, 'roll': s.roll} for s in all_students]
     
     return jsonify({
-        'session_id': session.id,
-        'date': session.date.isoformat(),
+        'session_id': class_session.id,
+        'date': class_session.date.isoformat(),
         'attendance_records_found': len(records_data),
         'total_students_in_subject': len(all_students_data),
         'attendance_records': records_data,
@@ -1221,45 +1486,63 @@ def debug_attendance_check(subject_id, date):
 # Attendance Session
 @app.route('/prof/<int:subject_id>/start_session', methods=['POST'])
 @login_required
+@prof_subject_required(api=True)
 def start_session(subject_id):
-    if not isinstance(current_user, User):
-        return jsonify({'status':'error','message':'Access denied'}), 403
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        return jsonify({'status':'error','message':'Not your subject'}), 403
-    now = datetime.utcnow()
+    subj = g.subject
+    now = utcnow()
     sess = ClassSession(subject_id=subj.id, date=now.date(), start_time=now)
     db.session.add(sess)
     db.session.commit()
+    invalidate_class_counts()
     return jsonify({'status':'ok','session_id': sess.id})
 
 @app.route('/prof/<int:subject_id>/mark_attendance')
 @login_required
+@prof_subject_required()
 def mark_attendance_page(subject_id):
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        flash('Not authorized.', 'danger')
-        return redirect(url_for('prof_dashboard'))
-    return render_template('mark_attendance.html', subject=subj)
+    subj = g.subject
+    return render_template('mark_attendance.html', subject=subj, websocket=socketio is not None)
 
 @app.route('/prof/<int:subject_id>/recognize', methods=['POST'])
 @login_required
+@prof_subject_required(api=True)
 def recognize_frame(subject_id):
-    if not isinstance(current_user, User):
-        return jsonify({'status':'error','message':'Access denied'}), 403
-    
-    data = request.get_json(force=True)
-    image = data.get('image')
-    session_id = data.get('session_id')
-    liveness_data = data.get('liveness_data', {}) 
-    
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        return jsonify({'status':'error','message':'Not your subject'}), 403
-    
+    if 'image' in request.files:
+        # Multipart upload: raw JPEG bytes, no base64 expansion
+        image = request.files['image'].read()
+        session_id = request.form.get('session_id', type=int)
+        liveness_data = json.loads(request.form.get('liveness_data') or '{}')
+    else:
+        data = request.get_json(force=True, silent=True) or {}
+        image = data.get('image')
+        session_id = data.get('session_id')
+        liveness_data = data.get('liveness_data', {})
+    
+    results, status_code = mark_frame(subject_id, image, session_id, liveness_data)
+    return jsonify({'results': results}), status_code
+
+if socketio is not None:
+    @socketio.on('connect', namespace='/attendance')
+    def attendance_connect(auth=None):
+        # Authenticated once per socket instead of once per frame
+        if not isinstance(current_user, User):
+            return False
+
+    @socketio.on('frame', namespace='/attendance')
+    def attendance_frame(data):
+        subject_id = data.get('subject_id')
+        # Ownership is checked on the first frame for a subject and remembered for the socket
+        if session.get('attendance_subject_id') != subject_id:
+            subj = db.session.get(Subject, subject_id)
+            if subj is None or subj.professor_id != current_user.id:
+                emit('results', {'results': [{'error': 'not_authorized', 'message': 'Not your subject'}]})
+                return
+            session['attendance_subject_id'] = subject_id
+        results, _ = mark_frame(subject_id, data.get('image'), data.get('session_id'), data.get('liveness_data') or {})
+        emit('results', {'results': results})
+
+def mark_frame(subject_id, image, session_id, liveness_data):
+    """Recognize one camera frame and mark attendance, returns (results, http status)"""
     # Check liveness data if provided
     if liveness_data:
         
@@ -1269,21 +1552,25 @@ def recognize_frame(subject_id):
         
         # Reject if spoofing detected
         if spoofing_detected:
-            return jsonify({'results': [{
+            return [{
                 'status': 'spoofing_detected',
                 'message': 'Spoofing detected - Attendance blocked'
-            }]})
+            }], 200
         
         # Require minimum anti-spoofing score
         if anti_spoofing_score < 60:  # 60% minimum
-            return jsonify({'results': [{
+            return [{
                 'status': 'low_anti_spoofing',
                 'message': 'Insufficient anti-spoofing verification'
-            }]})
+            }], 200
     
     matches = face_pipe.recognize_in_subject(subject_id, image)
-    today = datetime.utcnow().date()
+    today = utcnow().date()
     results = []
+    students = subject_students_by_roll(subject_id)
+    marked_in_session = session_marked_ids(session_id)
+    marked_today = day_marked_ids(subject_id, today)
+    pending_commit = False
 
     for m in matches:
         # Handle warnings first
@@ -1314,131 +1601,143 @@ def recognize_frame(subject_id):
             continue
 
         # Case-insensitive student lookup with exact match
-        st = Student.query.filter(
-            Student.roll.ilike(roll), 
-            Student.subject_id == subject_id
-        ).first()
+        st = students.get(roll.lower())
         
         if not st:
             results.append({'status': 'unknown', 'roll': roll, 'message': 'Student not found in database'})
             continue
+        st_id, st_name = st
 
         # For low confidence matches, 
         if status == 'low_confidence':
             results.append({
                 'status': 'low_confidence', 
                 'roll': roll, 
-                'name': st.name, 
+                'name': st_name, 
                 'confidence': confidence,
-                'message': f'Low confidence: {st.name} ({confidence:.3f})'
+                'message': f'Low confidence: {st_name} ({confidence:.3f})'
             })
             continue
 
         # Check if already marked in this session
-        existing_in_session = Attendance.query.filter_by(
-            class_session_id=session_id, 
-            student_id=st.id
-        ).first()
-        
-        if existing_in_session:
+        if st_id in marked_in_session:
             results.append({
                 'status': 'already_marked', 
                 'roll': roll, 
-                'name': st.name,
-                'message': f'{st.name} - Already marked in this session'
+                'name': st_name,
+                'message': f'{st_name} - Already marked in this session'
             })
             continue
 
         # Enforce once-per-day per subject
-        existing_today = Attendance.query.join(ClassSession).filter(
-            Attendance.student_id == st.id,
-            ClassSession.subject_id == subject_id,
-            ClassSession.date == today
-        ).first()
-        
-        if existing_today:
+        if st_id in marked_today:
             results.append({
                 'status': 'already_marked_today', 
                 'roll': roll, 
-                'name': st.name,
-                'message': f'{st.name} - Already marked today'
+                'name': st_name,
+                'message': f'{st_name} - Already marked today'
             })
             continue
 
         # Only mark attendance for high confidence matches 
         if status == 'recognized':
-            # Mark attendance with timestamp and liveness data
-            att = Attendance(
+            # Mark attendance with timestamp and liveness data; the unique
+            # (session, student) index turns a concurrent duplicate into a no-op
+            inserted = insert_attendance_once(
                 class_session_id=session_id,
-                student_id=st.id,
-                timestamp=datetime.utcnow(),
+                student_id=st_id,
+                timestamp=utcnow(),
                 status='present',
                 confidence=confidence,
                 reason=f"Liveness score: {liveness_data.get('livenessScore', 0)}% | Anti-spoofing: {liveness_data.get('antiSpoofingScore', 0)}%"
             )
-            db.session.add(att)
-            db.session.commit()
+            marked_in_session.add(st_id)
+            marked_today.add(st_id)
+            if not inserted:
+                results.append({
+                    'status': 'already_marked', 
+                    'roll': roll, 
+                    'name': st_name,
+                    'message': f'{st_name} - Already marked in this session'
+                })
+                continue
+            pending_commit = True
             
             # Log the attendance for debugging
-            logger.info(f" Attendance marked with anti-spoofing: {st.name} ({st.roll}) - Liveness: {liveness_data.get('livenessScore', 0)}%")
+            logger.info(f" Attendance marked with anti-spoofing: {st_name} ({roll}) - Liveness: {liveness_data.get('livenessScore', 0)}%")
             
             results.append({
                 'status': 'marked', 
                 'roll': roll, 
-                'name': st.name,
-                'student_id': st.id,
+                'name': st_name,
+                'student_id': st_id,
                 'confidence': confidence,
                 'liveness_score': liveness_data.get('livenessScore', 0),
                 'anti_spoofing_score': liveness_data.get('antiSpoofingScore', 0),
-                'message': f' Attendance marked for {st.name} with anti-spoofing verification'
+                'message': f' Attendance marked for {st_name} with anti-spoofing verification'
             })
         else:
             
             results.append({
                 'status': status,
                 'roll': roll,
-                'name': st.name,
+                'name': st_name,
                 'confidence': confidence,
                 'message': m.get('message', 'Recognition result')
             })
 
-    return jsonify({'results': results})
+    # One commit (one fsync) for every face marked in this frame
+    if pending_commit:
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # The marked sets already include this frame's students; reload them
+            invalidate_recognition_cache(subject_id)
+            logger.error(f"Failed to save attendance: {e}")
+            return [{'error': 'save_failed', 'message': 'Could not save attendance, please retry'}], 500
+
+    return results, 200
+
+def attendance_csv_rows(records):
+    """Yield an attendance CSV line by line so exports never build the whole file in memory"""
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(['student', 'roll', 'date', 'time', 'status', 'confidence'])
+    for r in records:
+        writer.writerow([r.student.name, r.student.roll, r.class_session.date,
+                         r.timestamp, r.status, r.confidence])
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+    yield line.getvalue()
 
 @app.route('/prof/<int:subject_id>/view_attendance')
 @login_required
+@prof_subject_required()
 def view_attendance(subject_id):
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        flash('Not authorized.', 'danger')
-        return redirect(url_for('prof_dashboard'))
+    subj = g.subject
 
     start = request.args.get('start')
     end = request.args.get('end')
-    q = Attendance.query.join(ClassSession).filter(ClassSession.subject_id==subj.id)
+    q = (Attendance.query.join(ClassSession)
+         .options(contains_eager(Attendance.class_session), joinedload(Attendance.student))
+         .filter(ClassSession.subject_id==subj.id))
     if start: q = q.filter(ClassSession.date >= start)
     if end: q = q.filter(ClassSession.date <= end)
-    rows = q.order_by(Attendance.timestamp.desc()).all()
+    q = q.order_by(Attendance.timestamp.desc())
+
+    if request.args.get('format') == 'csv':
+        return Response(stream_with_context(attendance_csv_rows(q.yield_per(500))),
+                        mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=attendance.csv'})
+
+    rows = q.all()
 
     #  all class dates for calendar
-    class_dates = [session.date.isoformat() for session in 
-                  ClassSession.query.filter_by(subject_id=subject_id).all()]
+    class_dates = [d.isoformat() for (d,) in
+                   db.session.query(ClassSession.date).filter_by(subject_id=subject_id)]
     total_classes = len(class_dates)
-
-    if request.args.get('format') == 'csv':
-        df = pd.DataFrame([{
-            'student': r.student.name,
-            'roll': r.student.roll,
-            'date': r.class_session.date,
-            'time': r.timestamp,
-            'status': r.status,
-            'confidence': r.confidence
-        } for r in rows])
-        buf = io.StringIO(); df.to_csv(buf, index=False); buf.seek(0)
-        return send_file(io.BytesIO(buf.getvalue().encode()), mimetype='text/csv',
-                         download_name='attendance.csv', as_attachment=True)
     
     return render_template('view_attendance.html', 
                          rows=rows, 
@@ -1452,11 +1751,9 @@ def view_attendance(subject_id):
 
 @app.route('/prof/<int:subject_id>/attendance_date/<date>')
 @login_required
+@prof_subject_required(api=True)
 def get_attendance_for_date(subject_id, date):
     """Get attendance records for a specific date - FIXED VERSION (handles multiple sessions per day)"""
-    if not isinstance(current_user, User):
-        return jsonify({'error': 'Access denied'}), 403
-    
     try:
         attendance_date = datetime.strptime(date, '%Y-%m-%d').date()
     except ValueError:
@@ -1481,41 +1778,36 @@ def get_attendance_for_date(subject_id, date):
     #   IDs of all sessions for this day
     session_ids = [s.id for s in sessions]
     
-    #  ALL attendance records for ALL sessions on this day
-    all_attendance_records = Attendance.query.filter(
+    #  One record per student across all of the day's sessions, chosen in SQL:
+    #  favor 'present', then the highest confidence
+    ranked = db.session.query(
+        Attendance.id.label('attendance_id'),
+        Attendance.student_id,
+        Student.name.label('student_name'),
+        Student.roll.label('student_roll'),
+        Attendance.status,
+        Attendance.confidence,
+        Attendance.timestamp,
+        func.row_number().over(
+            partition_by=Attendance.student_id,
+            order_by=[(Attendance.status == 'present').desc(),
+                      Attendance.confidence.desc().nulls_last(),
+                      Attendance.id]
+        ).label('rn')
+    ).join(Student, Student.id == Attendance.student_id).filter(
         Attendance.class_session_id.in_(session_ids)
-    ).join(Student).all()
-  
-
-    # Now, aggregate results by student
-   
-    student_records = {} 
-    
-    for record in all_attendance_records:
-        if record.student_id not in student_records:
-            # First time seeing this student today
-            student_records[record.student_id] = record
-        else:
-            # We've seen this student. Favor 'present' status.
-            if record.status == 'present' and student_records[record.student_id].status != 'present':
-                student_records[record.student_id] = record
-            # Also favor the record with the highest confidence if both are present
-            elif record.status == 'present' and record.confidence is not None and \
-                 (student_records[record.student_id].confidence is None or record.confidence > student_records[record.student_id].confidence):
-                 student_records[record.student_id] = record
-
-    #  the final list from our aggregated records
-    records_data = []
-    for student_id, record in student_records.items():
-        records_data.append({
-            'attendance_id': record.id,
-            'student_id': record.student.id,
-            'student_name': record.student.name,
-            'student_roll': record.student.roll,
-            'status': record.status,
-            'confidence': record.confidence,
-            'timestamp': record.timestamp.isoformat() if record.timestamp else None
-        })
+    ).subquery()
+    best_records = db.session.query(ranked).filter(ranked.c.rn == 1).all()
+
+    records_data = [{
+        'attendance_id': r.attendance_id,
+        'student_id': r.student_id,
+        'student_name': r.student_name,
+        'student_roll': r.student_roll,
+        'status': r.status,
+        'confidence': r.confidence,
+        'timestamp': r.timestamp.isoformat() if r.timestamp else None
+    } for r in best_records]
     
     # Count total students in subject for statistics
     total_students_in_subject = Student.query.filter_by(subject_id=subject_id).count()
@@ -1534,11 +1826,9 @@ def get_attendance_for_date(subject_id, date):
 
 @app.route('/prof/<int:subject_id>/student_attendance/<int:student_id>')
 @login_required
+@prof_subject_required(api=True)
 def get_student_attendance_details(subject_id, student_id):
     """Get detailed attendance for a specific student"""
-    if not isinstance(current_user, User):
-        return jsonify({'error': 'Access denied'}), 403
-    
     student = Student.query.get_or_404(student_id)
     
     # Calculate attendance statistics
@@ -1552,7 +1842,9 @@ def get_student_attendance_details(subject_id, student_id):
     attendance_percentage = (classes_attended / total_classes * 100) if total_classes > 0 else 0
     
     # Get recent attendance records
-    recent_attendance = Attendance.query.join(ClassSession).filter(
+    recent_attendance = Attendance.query.join(ClassSession).options(
+        contains_eager(Attendance.class_session)
+    ).filter(
         Attendance.student_id == student_id,
         ClassSession.subject_id == subject_id
     ).order_by(ClassSession.date.desc()).limit(10).all()
@@ -1577,11 +1869,9 @@ def get_student_attendance_details(subject_id, student_id):
 
 @app.route('/prof/<int:subject_id>/update_attendance/<int:attendance_id>', methods=['POST'])
 @login_required
+@prof_subject_required(api=True)
 def update_attendance_status(subject_id, attendance_id):
     """Update attendance status for a student"""
-    if not isinstance(current_user, User):
-        return jsonify({'error': 'Access denied'}), 403
-    
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No data provided'}), 400
@@ -1591,15 +1881,17 @@ def update_attendance_status(subject_id, attendance_id):
     if new_status not in ['present', 'absent']:
         return jsonify({'error': 'Invalid status'}), 400
     
-    attendance = Attendance.query.get_or_404(attendance_id)
-    
-    # Verify the attendance record belongs to the subject
-    if attendance.class_session.subject_id != subject_id:
-        return jsonify({'error': 'Attendance record does not belong to this subject'}), 403
+    # Ownership is part of the lookup, so no lazy class_session load afterwards
+    attendance = Attendance.query.join(ClassSession).filter(
+        Attendance.id == attendance_id,
+        ClassSession.subject_id == subject_id
+    ).first()
+    if attendance is None:
+        return jsonify({'error': 'Attendance record not found for this subject'}), 404
     
     attendance.status = new_status
     attendance.edited = True
-    attendance.reason = f"Manually updated by professor on {datetime.utcnow().isoformat()}"
+    attendance.reason = f"Manually updated by professor on {utcnow().isoformat()}"
     
     db.session.commit()
     
@@ -1607,11 +1899,9 @@ def update_attendance_status(subject_id, attendance_id):
 
 @app.route('/prof/<int:subject_id>/create_session', methods=['POST'])
 @login_required
+@prof_subject_required(api=True)
 def create_session(subject_id):
     """Create a class session for a specific date"""
-    if not isinstance(current_user, User):
-        return jsonify({'error': 'Access denied'}), 403
-    
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No data provided'}), 400
@@ -1625,50 +1915,48 @@ def create_session(subject_id):
     except ValueError:
         return jsonify({'error': 'Invalid date format'}), 400
     
-    # Check if session already exists
-    existing_session = ClassSession.query.filter_by(
+    # Check if session already exists (EXISTS, no ORM object loaded)
+    session_exists = db.session.query(ClassSession.query.filter_by(
         subject_id=subject_id,
         date=session_date
-    ).first()
+    ).exists()).scalar()
     
-    if existing_session:
+    if session_exists:
         return jsonify({'error': 'Class session already exists for this date'}), 400
     
     # Create new session
-    session = ClassSession(
+    class_session = ClassSession(
         subject_id=subject_id,
         date=session_date,
-        start_time=datetime.utcnow()
+        start_time=utcnow()
     )
     
-    db.session.add(session)
+    db.session.add(class_session)
     db.session.commit()
+    invalidate_class_counts()
     
     return jsonify({
         'status': 'success',
         'message': 'Class session created successfully',
-        'session_id': session.id
+        'session_id': class_session.id
     })
 
 @app.route('/prof/<int:subject_id>/delete_session/<int:session_id>', methods=['DELETE'])
 @login_required
+@prof_subject_required(api=True)
 def delete_session(subject_id, session_id):
     """Delete a class session and its attendance records"""
-    if not isinstance(current_user, User):
-        return jsonify({'error': 'Access denied'}), 403
-    
-    session = ClassSession.query.get_or_404(session_id)
-    
-    # Verify the session belongs to the subject
-    if session.subject_id != subject_id:
-        return jsonify({'error': 'Session does not belong to this subject'}), 403
-    
-    # Delete attendance records first
-    Attendance.query.filter_by(class_session_id=session_id).delete()
-    
-    # Delete the session
-    db.session.delete(session)
+    # Ownership is folded into both deletes; attendance rows go first
+    owned = ClassSession.query.filter_by(id=session_id, subject_id=subject_id)
+    Attendance.query.filter(
+        Attendance.class_session_id.in_(owned.with_entities(ClassSession.id).scalar_subquery())
+    ).delete(synchronize_session=False)
+    if not owned.delete(synchronize_session=False):
+        db.session.rollback()
+        return jsonify({'error': 'Session not found for this subject'}), 404
     db.session.commit()
+    invalidate_recognition_cache(subject_id)
+    invalidate_class_counts()
     
     return jsonify({
         'status': 'success',
@@ -1677,18 +1965,17 @@ def delete_session(subject_id, session_id):
 
 @app.route('/prof/<int:subject_id>/attendance/edit/<int:attendance_id>', methods=['GET', 'POST'])
 @login_required
+@prof_subject_required()
 def edit_attendance(subject_id, attendance_id):
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
+    subj = g.subject
 
-    subj = Subject.query.get_or_404(subject_id)
-    if subj.professor_id != current_user.id:
-        flash('Not authorized.', 'danger')
-        return redirect(url_for('prof_dashboard'))
-
-    att = Attendance.query.get_or_404(attendance_id)
-    if att.class_session.subject_id != subject_id:
+    att = Attendance.query.join(ClassSession).options(
+        contains_eager(Attendance.class_session), joinedload(Attendance.student)
+    ).filter(
+        Attendance.id == attendance_id,
+        ClassSession.subject_id == subject_id
+    ).first()
+    if att is None:
         flash('Attendance record mismatch.', 'danger')
         return redirect(url_for('view_attendance', subject_id=subject_id))
 
@@ -1716,7 +2003,7 @@ def login_student():
             return redirect(url_for('login_student'))
 
         # Case-insensitive roll number lookup - get ALL matching students
-        students = Student.query.filter(Student.roll.ilike(roll)).all()
+        students = Student.query.filter(func.lower(Student.roll) == roll.lower()).all()
 
         if not students:
             flash('Student not found. Please contact your professor.', 'danger')
@@ -1724,9 +2011,9 @@ def login_student():
 
         # If multiple students found with same roll, redirect to selection page
         if len(students) > 1:
-            # Store roll in session and redirect to selection page
-            from flask import session
+            # Store roll and matching ids in session and redirect to selection page
             session['pending_roll'] = roll
+            session['pending_student_ids'] = [s.id for s in students]
             return redirect(url_for('select_student_department'))
 
         # Single student found, log them in
@@ -1739,28 +2026,33 @@ def login_student():
 
 @app.route('/student/select_department')
 def select_student_department():
-    from flask import session
     roll = session.get('pending_roll')
-    if not roll:
+    student_ids = session.get('pending_student_ids')
+    if not roll or not student_ids:
         return redirect(url_for('login_student'))
     
-    students = Student.query.filter(Student.roll.ilike(roll)).all()
+    # Primary-key lookup of the students matched at login, no second roll scan
+    students = Student.query.options(
+        joinedload(Student.department), joinedload(Student.subject)
+    ).filter(Student.id.in_(student_ids)).all()
     return render_template('select_department.html', students=students, roll=roll)
 
 @app.route('/student/login/<int:student_id>')
 def login_specific_student(student_id):
+    # Only one of the students matched by the roll entered at login may be picked
+    if student_id not in session.get('pending_student_ids', []):
+        return redirect(url_for('login_student'))
     student = Student.query.get_or_404(student_id)
+    session.pop('pending_roll', None)
+    session.pop('pending_student_ids', None)
     login_user(student)
     flash(f'Welcome {student.name}!', 'success')
     return redirect(url_for('student_dashboard'))
 
 @app.route('/student/dashboard')
 @login_required
+@role_required(Student)
 def student_dashboard():
-    if not isinstance(current_user, Student):
-        flash('Access denied', 'danger')
-        return redirect(url_for('index'))
-
     student = current_user
     subject = student.subject
     department = student.department
@@ -1769,23 +2061,22 @@ def student_dashboard():
         flash('No subject assigned yet.', 'warning')
         return render_template('student_dashboard.html', student=student)
 
-    # Attendance summary for specific subject
-    total_classes = ClassSession.query.filter_by(subject_id=subject.id).count()
-    marked = Attendance.query.join(ClassSession).filter(
+    # Dates attended feed both the count and the trend chart
+    attended_dates = db.session.query(ClassSession.date).join(
+        Attendance, Attendance.class_session_id == ClassSession.id
+    ).filter(
         Attendance.student_id == student.id,
         ClassSession.subject_id == subject.id
-    ).count()
+    ).order_by(ClassSession.date).all()
+
+    # Attendance summary for specific subject
+    total_classes = total_classes_for(subject.id)
+    marked = len(attended_dates)
     perc = (marked / total_classes * 100) if total_classes > 0 else 0
     eligible = perc >= 75 or student.eligible_override
 
-    # Attendance trend data for  subject
-    attendance_records = Attendance.query.join(ClassSession).filter(
-        Attendance.student_id == student.id,
-        ClassSession.subject_id == subject.id
-    ).order_by(ClassSession.date).all()
-
-    chart_labels = [r.class_session.date.strftime('%Y-%m-%d') for r in attendance_records]
-    chart_values = list(range(1, len(attendance_records) + 1))
+    chart_labels = [d.isoformat() for (d,) in attended_dates]
+    chart_values = list(range(1, len(attended_dates) + 1))
 
     return render_template(
         'student_dashboard.html',
@@ -1800,70 +2091,97 @@ def student_dashboard():
         chart_values=chart_values
     )
 
+def build_attendance_pdf(student_id):
+    """Render one student's attendance report to PDF bytes (runs on report_executor)"""
+    # reportlab is only needed here, so keep it off the startup path
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+
+    with app.app_context():
+        student = db.session.get(Student, student_id)
+        subject = student.subject
+
+        # Render in memory; nothing is left behind in instance/
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=letter)
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(200, 760, "Student Attendance Report")
+
+        c.setFont("Helvetica", 12)
+        c.drawString(50, 730, f"Name: {student.name}")
+        c.drawString(50, 710, f"Roll No: {student.roll}")
+        if student.department:
+            c.drawString(50, 690, f"Department: {student.department.name}")
+        if subject:
+            c.drawString(50, 670, f"Subject: {subject.name}")
+
+        y = 640
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(50, y, "Date")
+        c.drawString(150, y, "Status")
+        c.drawString(250, y, "Confidence")
+        c.line(50, y - 5, 550, y - 5)
+
+        y -= 20
+        c.setFont("Helvetica", 10)
+
+        # Plain (date, status, confidence) rows, fetched in batches
+        rows = db.session.query(
+            ClassSession.date, Attendance.status, Attendance.confidence
+        ).join(Attendance, Attendance.class_session_id == ClassSession.id).filter(
+            Attendance.student_id == student.id,
+            ClassSession.subject_id == subject.id
+        ).order_by(ClassSession.date).yield_per(500)
+
+        for session_date, status, confidence in rows:
+            c.drawString(50, y, str(session_date))
+            c.drawString(150, y, status)
+            c.drawString(250, y, f"{confidence:.3f}")
+            y -= 15
+            if y < 50:
+                c.showPage()
+                y = 750
+
+        c.save()
+    return buf.getvalue()
+
 @app.route('/student/attendance/pdf')
 @login_required
+@role_required(Student)
 def download_student_attendance_pdf():
-    if not isinstance(current_user, Student):
-        flash('Access denied', 'danger')
-        return redirect(url_for('index'))
-
     student = current_user
-    subject = student.subject
-
-    pdf_path = os.path.join("instance", f"{student.roll}_attendance.pdf")
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(200, 760, "Student Attendance Report")
-
-    c.setFont("Helvetica", 12)
-    c.drawString(50, 730, f"Name: {student.name}")
-    c.drawString(50, 710, f"Roll No: {student.roll}")
-    if student.department:
-        c.drawString(50, 690, f"Department: {student.department.name}")
-    if subject:
-        c.drawString(50, 670, f"Subject: {subject.name}")
-
-    y = 640
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, y, "Date")
-    c.drawString(150, y, "Status")
-    c.drawString(250, y, "Confidence")
-    c.line(50, y - 5, 550, y - 5)
-
-    y -= 20
-    c.setFont("Helvetica", 10)
-
-    records = Attendance.query.join(ClassSession).filter(
-        Attendance.student_id == student.id,
-        ClassSession.subject_id == subject.id
-    ).order_by(ClassSession.date).all()
-
-    for r in records:
-        c.drawString(50, y, str(r.class_session.date))
-        c.drawString(150, y, r.status)
-        c.drawString(250, y, f"{r.confidence:.3f}")
-        y -= 15
-        if y < 50:
-            c.showPage()
-            y = 750
-
-    c.save()
-    return send_file(pdf_path, as_attachment=True, download_name=f"{student.roll}_attendance.pdf")
+    with report_jobs_lock:
+        now = time.monotonic()
+        for sid, (old, created) in list(report_jobs.items()):
+            if old.done() and now - created > REPORT_JOB_TTL_SECONDS:
+                del report_jobs[sid]
+        entry = report_jobs.get(student.id)
+        if entry is None:
+            entry = report_jobs[student.id] = (report_executor.submit(build_attendance_pdf, student.id), now)
+        job = entry[0]
+    # Short reports are usually ready within the wait; long ones answer 202 and the page retries
+    futures_wait([job], timeout=REPORT_WAIT_SECONDS)
+    if not job.done():
+        return render_template('report_pending.html'), 202
+    with report_jobs_lock:
+        if report_jobs.get(student.id, (None,))[0] is job:
+            del report_jobs[student.id]
+    return send_file(io.BytesIO(job.result()), mimetype='application/pdf', as_attachment=True,
+                     download_name=f"{student.roll}_attendance.pdf")
 
 @app.route('/student/attendance')
 @login_required
+@role_required(Student)
 def student_attendance_history():
-    if not isinstance(current_user, Student):
-        flash('Access denied', 'danger')
-        return redirect(url_for('index'))
-
     student = current_user
     subject = student.subject
 
     start = request.args.get('start')
     end = request.args.get('end')
 
-    q = Attendance.query.join(ClassSession).filter(
+    q = Attendance.query.join(ClassSession).options(
+        contains_eager(Attendance.class_session)
+    ).filter(
         Attendance.student_id == student.id,
         ClassSession.subject_id == subject.id
     )
@@ -1884,24 +2202,27 @@ def student_attendance_history():
 
 @app.route('/professor/change_password', methods=['GET', 'POST'])
 @login_required
+@role_required(User)
 def change_professor_password():
     """Allow professors to change their password"""
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
     if request.method == 'POST':
-        current_password = request.form.get('current_password', '').strip()
-        new_password = request.form.get('new_password', '').strip()
-        confirm_password = request.form.get('confirm_password', '').strip()
+        f = get_fields(request.form, 'current_password', 'new_password', 'confirm_password', maxlen=None)
+        current_password, new_password, confirm_password = f['current_password'], f['new_password'], f['confirm_password']
         
         if not current_password or not new_password or not confirm_password:
             flash('All fields are required.', 'danger')
             return redirect(url_for('change_professor_password'))
         
+        key = current_user.get_id()
+        if password_attempts.blocked(key):
+            flash(TOO_MANY_ATTEMPTS, 'danger')
+            return redirect(url_for('change_professor_password'))
+        
         if not current_user.check_password(current_password):
+            password_attempts.fail(key)
             flash('Current password is incorrect.', 'danger')
             return redirect(url_for('change_professor_password'))
+        password_attempts.reset(key)
         
         if new_password != confirm_password:
             flash('New passwords do not match.', 'danger')
@@ -1925,18 +2246,15 @@ def change_professor_password():
 
 @app.route('/professor/first_login', methods=['GET', 'POST'])
 @login_required
+@role_required(User)
 def professor_first_login():
     """Force password change on first login"""
-    if not isinstance(current_user, User):
-        flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
-    
     if not current_user.password_change_required:
         return redirect(url_for('prof_dashboard'))
     
     if request.method == 'POST':
-        new_password = request.form.get('new_password', '').strip()
-        confirm_password = request.form.get('confirm_password', '').strip()
+        f = get_fields(request.form, 'new_password', 'confirm_password', maxlen=None)
+        new_password, confirm_password = f['new_password'], f['confirm_password']
         
         if not new_password or not confirm_password:
             flash('Both fields are required.', 'danger')
@@ -1978,7 +2296,12 @@ def dev_reset_db():
         os.remove(db_path)
     with app.app_context():
         db.create_all()
+    invalidate_department_cache()
     return "reset"
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    if socketio is not None:
+        # Werkzeug is the dev server here (threading mode); Flask-SocketIO refuses it without a TTY otherwise
+        socketio.run(app, debug=True, allow_unsafe_werkzeug=True)
+    else:
+        app.run(debug=True)
@@ -0,0 +1,135 @@
+
+import urllib.request
+import os
+import bz2
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+SEGMENTS = 4
+CHUNK_SIZE = 1 << 16
+SHAPE_PREDICTOR_FILE = "shape_predictor_68_face_landmarks.dat"
+SHAPE_PREDICTOR_SHA256 = "fbdc2cb80eb9aa7a758672cbfdda32ba6300efe9b6e6c7a299ff7e736b11b92f"
+# Tried in order; the next mirror is used when one is down or serves a bad file
+SHAPE_PREDICTOR_URLS = [
+    "https://github.com/davisking/dlib-models/raw/master/shape_predictor_68_face_landmarks.dat.bz2",
+    "http://dlib.net/files/shape_predictor_68_face_landmarks.dat.bz2",
+]
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+def _ranged_size(url):
+    """Size of url if the server serves byte ranges, else None"""
+    req = urllib.request.Request(url, method='HEAD')
+    with urllib.request.urlopen(req) as resp:
+        if resp.headers.get('Accept-Ranges') != 'bytes':
+            return None
+        length = resp.headers.get('Content-Length')
+        return int(length) if length else None
+
+def _fetch_range(url, path, start, end):
+    req = urllib.request.Request(url, headers={'Range': f'bytes={start}-{end}'})
+    with urllib.request.urlopen(req) as resp, open(path, 'r+b') as f:
+        if resp.status != 206:
+            raise IOError("Server ignored the range request")
+        f.seek(start)
+        while True:
+            chunk = resp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+
+def _parallel_download(url, path, size):
+    """Fetch url into path over SEGMENTS concurrent range requests"""
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    step = -(-size // SEGMENTS)
+    with ThreadPoolExecutor(max_workers=SEGMENTS) as pool:
+        jobs = [pool.submit(_fetch_range, url, path, start, min(start + step, size) - 1)
+                for start in range(0, size, step)]
+        for job in jobs:
+            job.result()
+
+def _decompress_to(src, partial_file):
+    """Decompress a bz2 stream into partial_file chunk by chunk"""
+    decompressor = bz2.BZ2Decompressor()
+    with open(partial_file, 'wb') as fw:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            fw.write(decompressor.decompress(chunk))
+    if not decompressor.eof:
+        os.remove(partial_file)
+        raise IOError("Download ended before the end of the compressed stream")
+
+def _fetch_bz2(url, filename, sha256=None):
+    """Download and decompress one .bz2 url into filename, verified against sha256"""
+    partial_file = filename + ".part"
+    try:
+        size = _ranged_size(url)
+    except Exception:
+        size = None
+    if size:
+        # Several connections beat one throttled stream; decompress once all segments land
+        compressed_file = filename + ".bz2.part"
+        print(f"Downloading in {SEGMENTS} segments...")
+        try:
+            _parallel_download(url, compressed_file, size)
+            print("Extracting...")
+            with open(compressed_file, 'rb') as src:
+                _decompress_to(src, partial_file)
+        finally:
+            if os.path.exists(compressed_file):
+                os.remove(compressed_file)
+    else:
+        # Decompress while downloading: no .bz2 on disk, no whole-file read into memory
+        print("Downloading and extracting...")
+        with urllib.request.urlopen(url) as resp:
+            _decompress_to(resp, partial_file)
+    
+    if sha256 and _sha256(partial_file) != sha256:
+        os.remove(partial_file)
+        raise IOError("Checksum mismatch in the downloaded file")
+    
+    # Only a complete, verified file takes the final name
+    os.replace(partial_file, filename)
+
+def download(urls, filename, sha256=None):
+    """Fetch filename from the first of urls (.bz2 archives) that yields a valid file"""
+    if os.path.exists(filename):
+        if sha256 is None or _sha256(filename) == sha256:
+            print(f" Already exists: {filename}")
+            return True
+        print(f" Existing {filename} is corrupt or incomplete, downloading again")
+    
+    for url in urls:
+        print(f" Downloading {filename} from: {url}")
+        print(" This may take a few minutes...")
+        try:
+            _fetch_bz2(url, filename, sha256)
+        except Exception as e:
+            print(f" Download failed: {e}")
+            continue
+        print(f" Successfully downloaded: {filename}")
+        print(f" File size: {os.path.getsize(filename) / (1024*1024):.2f} MB")
+        return True
+    return False
+
+def download_shape_predictor():
+    """Download dlib's 68-face landmarks predictor used for liveness detection"""
+    if download(SHAPE_PREDICTOR_URLS, SHAPE_PREDICTOR_FILE, SHAPE_PREDICTOR_SHA256):
+        return True
+    print(f"You can manually download from: {SHAPE_PREDICTOR_URLS[-1]}")
+    print("Extract and place in the project root directory")
+    print(" Basic liveness detection will still work")
+    return False
+
+if __name__ == "__main__":
+    download_shape_predictor()
@@ -1,22 +1,214 @@
 
 import os
-import base64
+import binascii
 import numpy as np
 import pickle
+import json
 from PIL import Image
 import io
-from pathlib import Path
 from deepface import DeepFace
 import time
+from collections import OrderedDict
 import logging
 import cv2
-import tensorflow as tf
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from utils import list_subdirs, list_jpgs, count_jpgs
 import insightface
 from insightface.app import FaceAnalysis
+from insightface.utils import face_align
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Below this many students best_match skips the int8 pre-pass and scores every row exactly
+EXACT_SCAN_MAX = 16
+
+# Subjects with more students than this are searched through a FAISS index when faiss is installed
+FAISS_MIN_ROWS = 1000
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Page-locked staging for ArcFace batches on GPU providers; torch is only used for the allocation and copy
+try:
+    import torch
+    _pinned_ok = torch.cuda.is_available()
+except Exception:
+    torch = None
+    _pinned_ok = False
+_pinned = threading.local()
+
+# libjpeg-turbo decodes webcam frames noticeably faster than stock libjpeg
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _turbo_jpeg = TurboJPEG()
+except Exception:
+    _turbo_jpeg = None
+
+def decode_data_url(data_url):
+    """Decode a base64 image data URL straight to a BGR array, without touching disk"""
+    # a2b_base64 reads an ASCII str in place; b64decode would first copy it to bytes.
+    # Only the payload is sliced off - the header is never materialized.
+    encoded = data_url[data_url.index(',') + 1:]
+    return decode_image_bytes(binascii.a2b_base64(encoded))
+
+def decode_image_bytes(data):
+    """Decode raw encoded image bytes (e.g. a multipart upload) to a BGR array"""
+    if _turbo_jpeg is not None:
+        try:
+            return _turbo_jpeg.decode(data, pixel_format=TJPF_BGR)
+        except Exception:
+            pass  # not a JPEG - let OpenCV handle it
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+def encode_jpeg(img, quality=90):
+    """Encode a BGR array to JPEG bytes"""
+    if _turbo_jpeg is not None:
+        return _turbo_jpeg.encode(img, quality=quality, pixel_format=TJPF_BGR)
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode image")
+    return buf.tobytes()
+
+# enc_path -> (mtime_ns, loaded matrix), least recently used first; one version per subject
+_matrix_cache = OrderedDict()
+_matrix_cache_lock = threading.Lock()
+_MATRIX_CACHE_CAP = 32
+
+def _load_matrix_cached(enc_path, mtime_ns):
+    """_load_matrix, reused until the file's mtime changes"""
+    with _matrix_cache_lock:
+        hit = _matrix_cache.get(enc_path)
+        if hit is not None and hit[0] == mtime_ns:
+            _matrix_cache.move_to_end(enc_path)
+            return hit[1]
+    value = _load_matrix(enc_path)
+    with _matrix_cache_lock:
+        # Overwrites this subject's previous version instead of keeping it alongside
+        _matrix_cache[enc_path] = (mtime_ns, value)
+        _matrix_cache.move_to_end(enc_path)
+        while len(_matrix_cache) > _MATRIX_CACHE_CAP:
+            _matrix_cache.popitem(last=False)
+    return value
+
+def _evict_matrix(enc_path):
+    """Drop a subject's cached matrix, e.g. before its file is replaced"""
+    with _matrix_cache_lock:
+        _matrix_cache.pop(enc_path, None)
+
+def _load_matrix(enc_path):
+    """Read-only (rolls, E, E_q, scales, index) for one version of a subject's encodings"""
+    # Read fully rather than memory-mapped: Windows refuses to replace a file while a
+    # mapping of it is open, which would make every retrain of a recognized subject fail.
+    # Rolls and rows share one file, so they always come from the same save
+    with np.load(enc_path, allow_pickle=False) as data:
+        E = data['embeddings']
+        rolls = tuple(data['rolls'].tolist())
+    E.flags.writeable = False
+    E_q, scales = FacePipeline.quantize_rows(E)
+    E_q.flags.writeable = False
+    scales.flags.writeable = False
+    index = None
+    if faiss is not None and len(rolls) > FAISS_MIN_ROWS:
+        # Blocked SIMD inner-product search; built once per file version like E_q
+        index = faiss.IndexFlatIP(E.shape[1])
+        index.add(np.ascontiguousarray(E, dtype=np.float32))
+    return rolls, E, E_q, scales, index
+
+def align_top_face(det_model, rec_model, img, input_size=None):
+    """Run RetinaFace on img, return (face count, ArcFace-aligned crop of the top face or None)"""
+    bboxes, kpss = det_model.detect(img, input_size=input_size, max_num=0, metric='default')
+    if len(bboxes) == 0:
+        return 0, None
+    return len(bboxes), face_align.norm_crop(img, landmark=kpss[0], image_size=rec_model.input_size[0])
+
+def run_pinned(session, input_name, output_name, blob):
+    """session.run with the input staged in this thread's pinned buffer and DMA'd straight to the GPU"""
+    buf = getattr(_pinned, 'buf', None)
+    if buf is None or buf.numel() < blob.size:
+        buf = _pinned.buf = torch.empty(blob.size, dtype=torch.float32).pin_memory()
+    host = buf[:blob.size].view(*blob.shape)
+    host.numpy()[...] = blob
+    dev = host.to('cuda', non_blocking=True)
+    binding = session.io_binding()
+    binding.bind_input(input_name, 'cuda', 0, np.float32, list(blob.shape), dev.data_ptr())
+    binding.bind_output(output_name)
+    # onnxruntime computes on its own stream, so the copy has to land first
+    torch.cuda.current_stream().synchronize()
+    session.run_with_iobinding(binding)
+    return binding.copy_outputs_to_cpu()[0]
+
+def embed_crops(rec_model, crops):
+    """One ArcFace forward pass over aligned crops, returning L2-normalized float32 rows"""
+    session = rec_model.session
+    if _pinned_ok and session.get_providers()[0] != 'CPUExecutionProvider':
+        mean = rec_model.input_mean
+        blob = cv2.dnn.blobFromImages(crops, 1.0 / rec_model.input_std, rec_model.input_size,
+                                      (mean, mean, mean), swapRB=True)
+        feats = run_pinned(session, rec_model.input_name, rec_model.output_names[0], blob)
+    else:
+        feats = rec_model.get_feat(crops)
+    feats = np.asarray(feats, dtype=np.float32)
+    return feats / np.linalg.norm(feats, axis=1, keepdims=True)
+
+class FrameBatcher:
+    """Background worker that embeds queued webcam frames with one ArcFace forward pass per batch"""
+    def __init__(self, face_app, batch_size=4, maxsize=8, det_size=(320, 320)):
+        self.det_model = face_app.det_model
+        self.rec_model = face_app.models['recognition']
+        self.batch_size = batch_size
+        # Webcam frames hold one large face, so detection runs at a quarter of the
+        # enrollment resolution's cost; frames with no face there get a full-size retry
+        self.det_size = det_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        threading.Thread(target=self._run, name='frame-batcher', daemon=True).start()
+
+    def submit(self, img):
+        """Queue a frame; resolves to (face_count, normalized embedding or None)"""
+        future = Future()
+        try:
+            self._queue.put_nowait((img, future))
+        except queue.Full:
+            # Backlogged - embed this frame on the caller's thread instead
+            future.set_result(self.embed([img])[0])
+        return future
+
+    def _run(self):
+        while True:
+            # Block for one frame, then take whatever else is already waiting
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            imgs, futures = zip(*batch)
+            try:
+                results = self.embed(imgs)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def embed(self, imgs):
+        """Detect faces per frame, then embed every single-face crop in one batch"""
+        counts, crops = [], []
+        for img in imgs:
+            count, crop = align_top_face(self.det_model, self.rec_model, img, self.det_size)
+            if count == 0:
+                count, crop = align_top_face(self.det_model, self.rec_model, img)
+            counts.append(count)
+            if count == 1:
+                crops.append(crop)
+        feats = iter(embed_crops(self.rec_model, crops)) if crops else iter(())
+        return [(1, next(feats)) if count == 1 else (count, None) for count in counts]
+
 class FacePipeline:
     def __init__(self, enc_dir='instance/encodings', upload_dir='instance/uploads'):
         self.enc_dir = enc_dir
@@ -24,12 +216,25 @@ class FacePipeline:
         os.makedirs(self.enc_dir, exist_ok=True)
         os.makedirs(self.upload_dir, exist_ok=True)
         
+        # Threads that read and decode training images ahead of the model
+        self._decode_pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 4), thread_name_prefix='decode')
+        
+        # TensorRT engines are built on first use and reloaded from here afterwards
+        self.trt_cache_dir = os.path.join(os.path.dirname(self.enc_dir), 'trt_cache')
+        os.makedirs(self.trt_cache_dir, exist_ok=True)
+        
         # Initialize InsightFace model
         self.insightface_app = None
+        self.frame_batcher = None
         self.init_insightface()
         
-        # Clear any existing TensorFlow session
-        tf.keras.backend.clear_session()
+        # DeepFace only runs when InsightFace is unavailable; build its model once
+        # up front then, instead of tearing the TF graph down around every call
+        if self.insightface_app is None:
+            try:
+                DeepFace.build_model('ArcFace')
+            except Exception as e:
+                logger.warning(f" DeepFace warm-up failed: {e}")
         
         #   RetinaFace + ArcFace
         self.model_configs = {
@@ -72,12 +277,20 @@ class FacePipeline:
             else:
                 logger.info("Running on CPU")
             
-            # Initialize FaceAnalysis with RetinaFace detector and ArcFace recognizer
-            self.insightface_app = FaceAnalysis(
-                name='buffalo_l',
-                providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
-            )
-            self.insightface_app.prepare(ctx_id=0, det_size=(640, 640))
+            # Initialize FaceAnalysis with RetinaFace detector and ArcFace recognizer,
+            # as FP16 TensorRT engines when onnxruntime ships the TensorRT provider
+            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+            trt_providers = self.tensorrt_providers()
+            try:
+                self.insightface_app = FaceAnalysis(name='buffalo_l', providers=trt_providers or providers)
+                self.insightface_app.prepare(ctx_id=0, det_size=(640, 640))
+            except Exception as e:
+                if not trt_providers:
+                    raise
+                logger.warning(f" TensorRT unavailable ({e}), using CUDA provider")
+                self.insightface_app = FaceAnalysis(name='buffalo_l', providers=providers)
+                self.insightface_app.prepare(ctx_id=0, det_size=(640, 640))
+            self.frame_batcher = FrameBatcher(self.insightface_app)
             logger.info(" InsightFace (RetinaFace + ArcFace) initialized successfully on GPU!")
             
         except Exception as e:
@@ -85,11 +298,36 @@ class FacePipeline:
             logger.info(" Falling back to DeepFace with RetinaFace")
             self.insightface_app = None
 
-    def save_student_image(self, subject_id, roll, data_url):
-        """Save student image"""
+    def tensorrt_providers(self):
+        """TensorRT (FP16, cached engines) ahead of CUDA, or None if onnxruntime lacks it"""
+        try:
+            import onnxruntime
+        except ImportError:
+            return None
+        if 'TensorrtExecutionProvider' not in onnxruntime.get_available_providers():
+            return None
+        return [
+            ('TensorrtExecutionProvider', {
+                'trt_fp16_enable': True,
+                'trt_engine_cache_enable': True,
+                'trt_engine_cache_path': self.trt_cache_dir,
+                'trt_max_workspace_size': 2 << 30,
+            }),
+            'CUDAExecutionProvider',
+            'CPUExecutionProvider',
+        ]
+
+    def save_student_image(self, subject_id, roll, data_url, max_side=640):
+        """Save student image, downscaled once here so every retrain decodes less"""
         try:
-            header, encoded = data_url.split(',', 1)
-            data = base64.b64decode(encoded)
+            img = decode_data_url(data_url)
+            if img is None:
+                raise ValueError("Could not decode image")
+            h, w = img.shape[:2]
+            scale = max_side / max(h, w)
+            if scale < 1:
+                img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+            data = encode_jpeg(img, quality=90)
             
             subject_dir = os.path.join(self.upload_dir, str(subject_id))
             os.makedirs(subject_dir, exist_ok=True)
@@ -97,8 +335,7 @@ class FacePipeline:
             student_dir = os.path.join(subject_dir, roll)
             os.makedirs(student_dir, exist_ok=True)
             
-            existing_images = list(Path(student_dir).glob('*.jpg'))
-            next_num = len(existing_images) + 1
+            next_num = count_jpgs(student_dir) + 1
             
             img_path = os.path.join(student_dir, f'{next_num:03d}.jpg')
             with open(img_path, 'wb') as f:
@@ -109,14 +346,15 @@ class FacePipeline:
             logger.error(f"Error saving image: {e}")
             return None
 
-    def process_single_image_insightface(self, img_path):
+    def process_single_image_insightface(self, img_path, img=None):
         """Process image using InsightFace (RetinaFace + ArcFace)"""
         try:
             if self.insightface_app is None:
                 raise Exception("InsightFace not initialized")
             
-            # Read and process image
-            img = cv2.imread(str(img_path))
+            # Read and process image, unless it was already decoded
+            if img is None:
+                img = cv2.imread(str(img_path))
             if img is None:
                 raise Exception(f"Could not read image: {img_path}")
             
@@ -132,10 +370,7 @@ class FacePipeline:
             
             # Get embedding from the first face using ArcFace
             face = faces[0]
-            embedding = face.embedding
-            
-            # Normalize embedding
-            embedding = embedding / np.linalg.norm(embedding)
+            embedding = face.normed_embedding
             logger.debug(f" Successfully processed image with InsightFace")
             return embedding
             
@@ -143,16 +378,48 @@ class FacePipeline:
             logger.warning(f" InsightFace failed for {img_path}: {str(e)}")
             return None
 
-    def process_single_image_deepface(self, img_path, config):
+    def process_image_batch_insightface(self, img_paths, imgs, batch_size=32):
+        """Embeddings for decoded images (None where no face), ArcFace run batch_size crops at a time"""
+        det_model = self.insightface_app.det_model
+        rec_model = self.insightface_app.models['recognition']
+        results = [None] * len(img_paths)
+        pending_idx, pending_crops = [], []
+        
+        def flush():
+            for idx, emb in zip(pending_idx, embed_crops(rec_model, pending_crops)):
+                results[idx] = emb
+            pending_idx.clear()
+            pending_crops.clear()
+        
+        for idx, (img_path, img) in enumerate(zip(img_paths, imgs)):
+            if img is None:
+                logger.warning(f" Could not read image: {img_path}")
+                continue
+            try:
+                count, crop = align_top_face(det_model, rec_model, img)
+            except Exception as e:
+                logger.warning(f" InsightFace failed for {img_path}: {str(e)}")
+                continue
+            if count == 0:
+                logger.warning(f" No face detected in {img_path}")
+                continue
+            if count > 1:
+                logger.warning(f" Multiple faces detected in {img_path}, using first face")
+            pending_idx.append(idx)
+            pending_crops.append(crop)
+            if len(pending_crops) >= batch_size:
+                flush()
+        if pending_crops:
+            flush()
+        return results
+
+    def process_single_image_deepface(self, img_path, config, img=None):
         """Fallback processing using DeepFace with RetinaFace"""
         try:
             logger.debug(f"Processing image with DeepFace: {img_path}")
             
-            # Clear session periodically to prevent memory buildup
-            tf.keras.backend.clear_session()
-            
             rep = DeepFace.represent(
-                img_path=str(img_path),
+                img_path=img if img is not None else str(img_path),
                 model_name=config.get('model_name', 'ArcFace'),
                 detector_backend=config['detector_backend'],
                 enforce_detection=config['enforce_detection'],
@@ -171,29 +438,25 @@ class FacePipeline:
                 
         except Exception as e:
             logger.warning(f" DeepFace failed to process {img_path}: {str(e)}")
-            # Clear session on error
-            tf.keras.backend.clear_session()
             return None
 
-    def process_single_image(self, img_path, config):
+    def process_single_image(self, img_path, config, img=None):
         """Process single image with InsightFace primary, DeepFace fallback"""
         # Try InsightFace first
         if config.get('use_insightface', True) and self.insightface_app is not None:
-            embedding = self.process_single_image_insightface(img_path)
+            embedding = self.process_single_image_insightface(img_path, img)
             if embedding is not None:
                 return embedding
         
         # Fallback to DeepFace
         logger.info(f" Falling back to DeepFace for {img_path}")
-        return self.process_single_image_deepface(img_path, config)
+        return self.process_single_image_deepface(img_path, config, img)
 
-    def train_subject_optimized(self, subject_id, mode='high_quality'):
+    def train_subject_optimized(self, subject_id, mode='high_quality', progress_cb=None):
         """
         OPTIMIZED TRAINING - With RetinaFace + ArcFace
+        progress_cb(i, total, roll) is called as each student is started
         """
-        # Clear session at start
-        tf.keras.backend.clear_session()
-        
         config = self.model_configs[mode]
         subject_path = os.path.join(self.upload_dir, str(subject_id))
         
@@ -203,7 +466,7 @@ class FacePipeline:
         encodings = {}
         start_time = time.time()
         
-        students = [d for d in os.listdir(subject_path) if os.path.isdir(os.path.join(subject_path, d))]
+        students = list_subdirs(subject_path)
         
         if not students:
             return {'status': 'error', 'message': 'No students found with images'}
@@ -215,76 +478,82 @@ class FacePipeline:
         total_processed = 0
         successful_students = 0
         
+        # Select images for processing
+        samples = [list_jpgs(os.path.join(subject_path, roll))[:config['images_per_student']]
+                   for roll in students]
+        
+        def prefetch(paths):
+            # Decode on the pool (cv2 releases the GIL) while the model works on something else
+            return [self._decode_pool.submit(cv2.imread, p) for p in paths]
+        
+        next_decodes = prefetch(samples[0])
+        
         # Process students with progress logging and memory management
         for i, roll in enumerate(students):
+            # Start the next student's decodes before embedding this one
+            decodes = next_decodes
+            next_decodes = prefetch(samples[i + 1]) if i + 1 < len(students) else []
             try:
                 logger.info(f" Processing student {i+1}/{len(students)}: {roll}")
+                if progress_cb:
+                    progress_cb(i, len(students), roll)
                 
-                roll_path = os.path.join(subject_path, roll)
-                image_paths = list(Path(roll_path).glob('*.jpg'))
+                sample_paths = samples[i]
                 
-                if not image_paths:
+                if not sample_paths:
                     logger.warning(f" No images found for {roll}")
                     continue
                 
-                # Select images for processing
-                sample_size = min(config['images_per_student'], len(image_paths))
-                sample_paths = image_paths[:sample_size]
-                
                 logger.info(f"    Processing {len(sample_paths)} images for {roll}")
                 
-                # Process this student's images
-                embeddings = []
+                # Process this student's images; embeddings are unit-norm, so summing
+                # them and normalizing once gives the same direction as their mean
+                acc = np.zeros(512, dtype=np.float32)
                 successful_images = 0
                 
-                for j, img_path in enumerate(sample_paths):
+                # One ArcFace pass for the whole student, detection starting as soon as
+                # the first image is decoded; per-image DeepFace only where it found nothing
+                if config.get('use_insightface', True) and self.insightface_app is not None:
+                    batch = self.process_image_batch_insightface(sample_paths, (d.result() for d in decodes))
+                else:
+                    batch = [None] * len(sample_paths)
+                for j, (img_path, decode, embedding) in enumerate(zip(sample_paths, decodes, batch)):
                     try:
-                        embedding = self.process_single_image(img_path, config)
+                        if embedding is None:
+                            logger.info(f" Falling back to DeepFace for {img_path}")
+                            embedding = self.process_single_image_deepface(img_path, config, decode.result())
                         if embedding is not None:
-                            embeddings.append(embedding)
+                            acc += embedding
                             successful_images += 1
                             total_processed += 1
                     except Exception as e:
                         logger.warning(f"   ⚠️ Failed image {j+1} for {roll}: {e}")
                         continue
                 
-                if embeddings:
+                if successful_images:
                     #  robust embedding using mean of all embeddings
-                    embeddings_array = np.array(embeddings)
+                    acc /= np.linalg.norm(acc)
                     
-                    # Use mean for better representation
-                    final_embedding = np.mean(embeddings_array, axis=0)
-                    final_embedding = final_embedding / np.linalg.norm(final_embedding)
-                    
-                    encodings[roll] = final_embedding
+                    encodings[roll] = acc
                     successful_students += 1
                     
                     logger.info(f"    {roll}: {successful_images}/{len(sample_paths)} images successful")
                 else:
                     logger.warning(f"    {roll}: No valid face embeddings found")
-                
-                # Clear session after each student to free memory
-                tf.keras.backend.clear_session()
                     
             except Exception as e:
                 logger.error(f" Error processing student {roll}: {e}")
-                tf.keras.backend.clear_session()
                 continue
 
         # Save encodings if we have any
         if encodings:
-            out_file = os.path.join(self.enc_dir, f'subject_{subject_id}_enc.pkl')
-            with open(out_file, 'wb') as f:
-                pickle.dump(encodings, f)
+            out_file = self.save_encodings(subject_id, encodings)
             logger.info(f"Saved encodings for {len(encodings)} students to {out_file}")
         else:
             logger.error(" No encodings were generated - training failed")
 
         training_time = time.time() - start_time
         
-        # Final memory cleanup
-        tf.keras.backend.clear_session()
-        
         # Build result
         result = {
             'status': 'success' if successful_students > 0 else 'error',
@@ -313,15 +582,15 @@ class FacePipeline:
             if self.insightface_app is None:
                 raise Exception("InsightFace not initialized")
             
-            # Read and process image
-            img = cv2.imread(str(img_path))
+            # Read and process image (callers may pass an already decoded frame)
+            img = img_path if isinstance(img_path, np.ndarray) else cv2.imread(str(img_path))
             if img is None:
                 raise Exception(f"Could not read image: {img_path}")
             
-            # Detect faces using RetinaFace
-            faces = self.insightface_app.get(img)
+            # Detect with RetinaFace and embed with ArcFace, batched with other in-flight frames
+            face_count, query_embedding = self.frame_batcher.submit(img).result(timeout=10)
             
-            if len(faces) == 0:
+            if face_count == 0:
                 logger.info(" NO FACE DETECTED by RetinaFace")
                 return [{
                     'roll': None,
@@ -331,31 +600,13 @@ class FacePipeline:
                     'message': 'No face detected in the image'
                 }]
             
-            if len(faces) > 1:
+            if face_count > 1:
                 logger.warning(" Multiple faces detected by RetinaFace")
                 return [{'warning': 'multiple_faces', 'message': 'Multiple faces detected. Please ensure only one student is in frame.'}]
             
-            # Get embedding from the detected face using ArcFace
-            face = faces[0]
-            query_embedding = face.embedding
-            query_embedding = query_embedding / np.linalg.norm(query_embedding)
-            
             # Calculate similarity with known encodings
-            best_match = None
-            best_similarity = 0
-            all_matches = []
-            
-            for roll, known_embedding in known_encodings.items():
-                similarity = np.dot(query_embedding, known_embedding)
-                all_matches.append({'roll': roll, 'similarity': similarity})
-                
-                if similarity > best_similarity:
-                    best_similarity = similarity
-                    best_match = roll
-            
-            # Sort matches by similarity for debugging
-            all_matches.sort(key=lambda x: x['similarity'], reverse=True)
-            logger.info(f" Recognition - Top matches: {all_matches[:3]}")
+            best_match, best_similarity, top_matches = self.best_match(query_embedding, known_encodings)
+            logger.info(f" Recognition - Top matches: {top_matches}")
             logger.info(f" Best match: {best_match} with similarity: {best_similarity:.3f}")
             
             # Apply recognition thresholds
@@ -401,7 +652,7 @@ class FacePipeline:
         """Fallback recognition using DeepFace with RetinaFace"""
         try:
             rep = DeepFace.represent(
-                img_path=str(img_path),
+                img_path=img_path if isinstance(img_path, np.ndarray) else str(img_path),
                 model_name=config.get('model_name', 'ArcFace'),
                 detector_backend=config['detector_backend'],
                 enforce_detection=config['enforce_detection'],
@@ -416,20 +667,8 @@ class FacePipeline:
                 query_embedding = np.array(rep[0]['embedding'])
                 query_embedding = query_embedding / np.linalg.norm(query_embedding)
                 
-                best_match = None
-                best_similarity = 0
-                all_matches = []
-                
-                for roll, known_embedding in known_encodings.items():
-                    similarity = np.dot(query_embedding, known_embedding)
-                    all_matches.append({'roll': roll, 'similarity': similarity})
-                    
-                    if similarity > best_similarity:
-                        best_similarity = similarity
-                        best_match = roll
-                
-                all_matches.sort(key=lambda x: x['similarity'], reverse=True)
-                logger.info(f"🔍 DeepFace Recognition - Top matches: {all_matches[:3]}")
+                best_match, best_similarity, top_matches = self.best_match(query_embedding, known_encodings)
+                logger.info(f"🔍 DeepFace Recognition - Top matches: {top_matches}")
                 
                 recognition_threshold = config['recognition_threshold']
                 min_confidence = config['min_confidence']
@@ -471,68 +710,156 @@ class FacePipeline:
             logger.error(f"DeepFace recognition error: {e}")
             raise e
 
-    def recognize_in_subject(self, subject_id, data_url):
+    def recognize_in_subject(self, subject_id, image):
         """BALANCED RECOGNITION - Using RetinaFace + ArcFace"""
         try:
-            # Clear session before recognition
-            tf.keras.backend.clear_session()
-            
-            header, encoded = data_url.split(',', 1)
-            data = base64.b64decode(encoded)
-            
-            tmp_path = os.path.join(self.upload_dir, 'tmp_recognition.jpg')
-            with open(tmp_path, 'wb') as f:
-                f.write(data)
-
-            known_encodings = self.load_encodings(subject_id)
-            if not known_encodings:
+            known_encodings = self.load_encoding_matrix(subject_id)
+            if known_encodings is None:
                 return [{'warning': 'no_model', 'message': 'No trained model found for this subject'}]
 
+            # Raw bytes from a multipart upload, or a base64 data URL from a JSON body
+            img = decode_image_bytes(image) if isinstance(image, bytes) else decode_data_url(image)
+            if img is None:
+                raise ValueError("Could not decode image")
+
             config = self.model_configs['high_quality']
             
             # Try InsightFace first
             if config.get('use_insightface', True) and self.insightface_app is not None:
                 try:
-                    result = self.recognize_with_insightface(tmp_path, known_encodings, config)
+                    result = self.recognize_with_insightface(img, known_encodings, config)
                     return result
                 except Exception as e:
                     logger.warning(f"InsightFace recognition failed, falling back: {e}")
             
             # Fallback to DeepFace
             logger.info("🔄 Falling back to DeepFace for recognition")
-            result = self.recognize_with_deepface(tmp_path, known_encodings, config)
+            result = self.recognize_with_deepface(img, known_encodings, config)
             return result
             
         except Exception as e:
             logger.error(f"Recognition error: {e}")
-            tf.keras.backend.clear_session()
             return [{'error': 'recognition_failed', 'message': f'Recognition failed: {str(e)}'}]
-        finally:
-            # Clean up temporary file
+
+    def encoding_path(self, subject_id):
+        """Packed float32 encoding matrix with the roll for each of its rows"""
+        return os.path.join(self.enc_dir, f'subject_{subject_id}.npz')
+
+    def save_encodings(self, subject_id, encodings):
+        """Write {roll: embedding} as one .npz holding the normalized float32 rows and their rolls"""
+        enc_path = self.encoding_path(subject_id)
+        rolls = list(encodings)
+        E = np.stack([encodings[r] for r in rolls]).astype(np.float32)
+        E /= np.linalg.norm(E, axis=1, keepdims=True)
+        # Write beside the target and swap in with one rename, so readers never
+        # see a partial file or rolls from a different save than the rows
+        with open(enc_path + '.tmp', 'wb') as f:
+            np.savez(f, embeddings=E, rolls=np.array(rolls, dtype=str))
+        # Release the old version before swapping the file underneath it
+        _evict_matrix(enc_path)
+        os.replace(enc_path + '.tmp', enc_path)
+        return enc_path
+
+    def migrate_legacy_encodings(self, subject_id):
+        """Convert a pickle or .npy/.rolls.json pair written by older versions into the packed format"""
+        base = os.path.join(self.enc_dir, f'subject_{subject_id}')
+        npy_path, rolls_path = base + '.npy', base + '.rolls.json'
+        if os.path.exists(npy_path) and os.path.exists(rolls_path):
             try:
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
-            except:
-                pass
+                E = np.load(npy_path)
+                with open(rolls_path) as f:
+                    rolls = json.load(f)
+                if len(rolls) != E.shape[0]:
+                    return False
+                self.save_encodings(subject_id, dict(zip(rolls, E)))
+                os.remove(npy_path)
+                os.remove(rolls_path)
+                return True
+            except Exception as e:
+                logger.error(f"Error migrating encodings: {e}")
+                return False
+        p = base + '_enc.pkl'
+        if not os.path.exists(p):
+            return False
+        try:
+            with open(p, 'rb') as f:
+                encodings = pickle.load(f)
+            if encodings:
+                self.save_encodings(subject_id, encodings)
+            os.remove(p)
+            return bool(encodings)
+        except Exception as e:
+            logger.error(f"Error migrating encodings: {e}")
+            return False
 
     def load_encodings(self, subject_id):
-        p = os.path.join(self.enc_dir, f'subject_{subject_id}_enc.pkl')
-        if not os.path.exists(p):
+        known = self.load_encoding_matrix(subject_id)
+        if known is None:
             return {}
+        rolls, E = known[:2]
+        return dict(zip(rolls, E))
+
+    def load_encoding_matrix(self, subject_id):
+        """Read-only encoding matrix and rolls, cached until the file changes"""
+        enc_path = self.encoding_path(subject_id)
         try:
-            with open(p, 'rb') as f:
-                return pickle.load(f)
+            mtime_ns = os.stat(enc_path).st_mtime_ns
+        except OSError:
+            if not self.migrate_legacy_encodings(subject_id):
+                return None
+            mtime_ns = os.stat(enc_path).st_mtime_ns
+        try:
+            # Keyed by mtime, so a retrain is picked up without any signalling
+            return _load_matrix_cached(enc_path, mtime_ns)
         except Exception as e:
             logger.error(f"Error loading encodings: {e}")
-            return {}
+            return None
+
+    @staticmethod
+    def quantize_rows(E):
+        """Symmetric per-row int8 quantization, returns (int8 matrix, float32 row scales)"""
+        scales = np.abs(E).max(axis=1) / 127
+        scales[scales == 0] = 1
+        E_q = np.round(E / scales[:, None]).astype(np.int8)
+        return E_q, scales.astype(np.float32)
+
+    @staticmethod
+    def best_match(query_embedding, known, shortlist=3):
+        """Rank every student with an int8 dot product (or FAISS), then rescore the shortlist in float32"""
+        rolls, E, E_q, scales, index = known
+        q = np.asarray(query_embedding, dtype=np.float32)
+        if index is not None:
+            # Large subjects: FAISS returns the shortlist already scored exactly
+            exact, top = index.search(q[None], min(shortlist, len(rolls)))
+            exact, top = exact[0], top[0]
+        elif len(rolls) <= EXACT_SCAN_MAX:
+            # Small classes: one exact float32 GEMV is cheaper than quantizing the query
+            top = np.arange(len(rolls))
+        else:
+            q_scale = float(np.abs(q).max()) / 127 or 1.0
+            q_q = np.round(q / q_scale).astype(np.int32)
+            # einsum accumulates int8 x int32 in int32 through small buffers, so the
+            # int8 matrix is streamed as-is instead of first being widened to a 4x copy
+            approx = np.einsum('ij,j->i', E_q, q_q, dtype=np.int32) * scales * q_scale
+            # argpartition finds the shortlist in O(N); only those few rows get sorted
+            k = min(shortlist, len(approx))
+            top = np.argpartition(-approx, k - 1)[:k]
+        if index is None:
+            # Thresholds are applied to exact similarities, not the quantized estimate
+            exact = np.asarray(E[top], dtype=np.float32) @ q
+        order = np.argsort(exact)[::-1][:shortlist]
+        top_matches = [{'roll': rolls[top[i]], 'similarity': float(exact[i])} for i in order]
+        best_similarity = top_matches[0]['similarity']
+        best_match = top_matches[0]['roll'] if best_similarity > 0 else None
+        return best_match, max(best_similarity, 0.0), top_matches
 
     def train_report(self, subject_id):
         subject_path = os.path.join(self.upload_dir, str(subject_id))
         if not os.path.exists(subject_path):
             return {'students': 0}
             
-        students = [d for d in os.listdir(subject_path) if os.path.isdir(os.path.join(subject_path, d))]
-        counts = [len(list(Path(os.path.join(subject_path, s)).glob('*.jpg'))) for s in students]
+        students = list_subdirs(subject_path)
+        counts = [count_jpgs(os.path.join(subject_path, s)) for s in students]
         
         return {
             'students': len(students),
@@ -1,6 +1,7 @@
 
 import tensorflow as tf
 import os
+import threading
 
 def setup_gpu():
     # Clear any previous TensorFlow session
@@ -32,3 +33,16 @@ def setup_gpu():
 def force_cpu():
     os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
     print("  Forcing CPU mode")
+
+_gpu_lock = threading.Lock()
+_use_gpu = None
+
+def init_gpu():
+    """Run setup_gpu once per process, falling back to CPU, and cache the outcome"""
+    global _use_gpu
+    with _gpu_lock:
+        if _use_gpu is None:
+            _use_gpu = setup_gpu()
+            if not _use_gpu:
+                force_cpu()
+        return _use_gpu
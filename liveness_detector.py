@@ -1,15 +1,79 @@
 
 import cv2
 import numpy as np
-from scipy.spatial import distance as dist
-from collections import OrderedDict
+from collections import OrderedDict, deque
+import math
+import os
 import time
 
+# numba compiles the per-frame kernels below to native code when it is installed
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _ear_kernel(eye):
+    """Eye aspect ratio of one (6, 2) float32 eye"""
+    a = math.hypot(eye[1, 0] - eye[5, 0], eye[1, 1] - eye[5, 1])
+    b = math.hypot(eye[2, 0] - eye[4, 0], eye[2, 1] - eye[4, 1])
+    c = math.hypot(eye[0, 0] - eye[3, 0], eye[0, 1] - eye[3, 1])
+    return (a + b) / (2.0 * c)
+
+
+def _mar_kernel(mouth):
+    """Mouth aspect ratio of one (20, 2) float32 mouth"""
+    a = math.hypot(mouth[13, 0] - mouth[19, 0], mouth[13, 1] - mouth[19, 1])
+    b = math.hypot(mouth[14, 0] - mouth[18, 0], mouth[14, 1] - mouth[18, 1])
+    c = math.hypot(mouth[15, 0] - mouth[17, 0], mouth[15, 1] - mouth[17, 1])
+    d = math.hypot(mouth[12, 0] - mouth[16, 0], mouth[12, 1] - mouth[16, 1])
+    return (a + b + c) / (3.0 * d)
+
+
+def _welford_push(buf, idx, count, mean, M2, x0, x1):
+    """Write (x0, x1) into ring slot idx, updating mean/M2 in place (Welford); returns the new count"""
+    if count < buf.shape[0]:
+        count += 1
+        d0 = x0 - mean[0]
+        d1 = x1 - mean[1]
+        mean[0] += d0 / count
+        mean[1] += d1 / count
+        M2[0] += d0 * (x0 - mean[0])
+        M2[1] += d1 * (x1 - mean[1])
+    else:
+        # Full window: add the new point and remove the one it overwrites in one step
+        o0 = buf[idx, 0]
+        o1 = buf[idx, 1]
+        m0 = mean[0]
+        m1 = mean[1]
+        mean[0] += (x0 - o0) / count
+        mean[1] += (x1 - o1) / count
+        M2[0] = max(0.0, M2[0] + (x0 - o0) * (x0 - mean[0] + o0 - m0))
+        M2[1] = max(0.0, M2[1] + (x1 - o1) * (x1 - mean[1] + o1 - m1))
+    buf[idx, 0] = x0
+    buf[idx, 1] = x1
+    return count
+
+
+if njit is not None:
+    _ear_kernel = njit(cache=True, fastmath=True, error_model='numpy')(_ear_kernel)
+    _mar_kernel = njit(cache=True, fastmath=True, error_model='numpy')(_mar_kernel)
+    _welford_push = njit(cache=True, fastmath=True, error_model='numpy')(_welford_push)
+
 class LivenessDetector:
     def __init__(self):
-        # Eye aspect ratio thresholds
-        self.EYE_AR_THRESH = 0.25
+        # Eye aspect ratio thresholds; EYE_AR_THRESH is replaced per user by
+        # median - 2 sigma of their first EAR_BASELINE_FRAMES readings. Blinks in
+        # that window are included and pull the threshold down, hence the floor
+        self.EYE_AR_THRESH_DEFAULT = 0.25
+        self.EYE_AR_THRESH_MIN = 0.15
+        self.EYE_AR_THRESH = self.EYE_AR_THRESH_DEFAULT
         self.EYE_AR_CONSEC_FRAMES = 3
+        self.EAR_BASELINE_FRAMES = 45  # 1.5 s at 30 fps
+        self.FPS = 30
+        # Causal moving average (about 40 ms) over EAR before thresholding, against landmark jitter.
+        # At 30 fps this rounds to 1 frame, i.e. no smoothing; it only kicks in at higher FPS
+        self.EAR_SMOOTH_FRAMES = max(1, round(0.04 * self.FPS))
         
         # Mouth aspect ratio thresholds for yawning detection
         self.MAR_THRESH = 0.5
@@ -17,6 +81,7 @@ class LivenessDetector:
         # Head movement thresholds
         self.HEAD_MOVEMENT_THRESH = 10  # pixels
         self.MIN_FRAMES_FOR_HEAD_MOVEMENT = 10
+        self.HEAD_MOVEMENT_WINDOW = 30
         
         # Face landmarks indices 
         self.FACIAL_LANDMARKS_IDXS = OrderedDict([
@@ -29,6 +94,12 @@ class LivenessDetector:
             ("jaw", (0, 17))
         ])
         
+        # Landmark pairs whose distances make up the aspect ratios (vertical pairs, then the horizontal one)
+        self._eye_v = np.array([[1, 5], [2, 4]])
+        self._eye_h = np.array([0, 3])
+        self._mouth_v = np.array([[13, 19], [14, 18], [15, 17]])
+        self._mouth_h = np.array([12, 16])
+        
         # Initialize counters and trackers
         self.eye_blink_count = 0
         self.yawn_count = 0
@@ -36,7 +107,14 @@ class LivenessDetector:
         self.consecutive_frames_mouth_open = 0
         self.head_movement_detected = False
         self.liveness_score = 0
-        self.face_positions = []
+        self._ear_baseline = np.empty(self.EAR_BASELINE_FRAMES)
+        self._ear_seen = 0
+        self._ear_recent = deque(maxlen=self.EAR_SMOOTH_FRAMES)
+        self.face_positions = np.empty((self.HEAD_MOVEMENT_WINDOW, 2), dtype=np.float64)
+        self._rb_idx = 0
+        self._rb_count = 0
+        self._mean = np.zeros(2)
+        self._M2 = np.zeros(2)
         self.last_face_position = None
         self.start_time = None
         self.is_live = False
@@ -45,6 +123,12 @@ class LivenessDetector:
         self.total_frames_processed = 0
         self.liveness_check_started = False
         
+        if njit is not None:
+            # Compile (or load from cache) now rather than on the first frame
+            _ear_kernel(np.arange(12, dtype=np.float32).reshape(6, 2))
+            _mar_kernel(np.arange(40, dtype=np.float32).reshape(20, 2))
+            _welford_push(np.zeros((2, 2)), 0, 0, np.zeros(2), np.zeros(2), 0.0, 0.0)
+        
     def start_liveness_check(self):
         """Start a new liveness check session"""
         self.reset()
@@ -59,47 +143,80 @@ class LivenessDetector:
         self.consecutive_frames_mouth_open = 0
         self.head_movement_detected = False
         self.liveness_score = 0
-        self.face_positions = []
+        self.EYE_AR_THRESH = self.EYE_AR_THRESH_DEFAULT
+        self._ear_seen = 0
+        self._ear_recent.clear()
+        self._rb_idx = 0
+        self._rb_count = 0
+        self._mean[:] = 0
+        self._M2[:] = 0
         self.last_face_position = None
         self.is_live = False
         self.total_frames_processed = 0
         
     def eye_aspect_ratio(self, eye):
         """Calculate the eye aspect ratio"""
+        if njit is not None:
+            return _ear_kernel(np.ascontiguousarray(eye, dtype=np.float32))
+        eye = np.asarray(eye, dtype=np.float32)
         
-        A = dist.euclidean(eye[1], eye[5])
-        B = dist.euclidean(eye[2], eye[4])
-        
-        
-        C = dist.euclidean(eye[0], eye[3])
+        # Both vertical distances in one norm over the stacked pairs
+        v = np.linalg.norm(eye[self._eye_v[:, 0]] - eye[self._eye_v[:, 1]], axis=1)
+        h = np.linalg.norm(eye[self._eye_h[0]] - eye[self._eye_h[1]])
         
         # Compute the eye aspect ratio
-        ear = (A + B) / (2.0 * C)
+        ear = v.sum() / (2.0 * h)
         return ear
     
     def mouth_aspect_ratio(self, mouth):
         """Calculate the mouth aspect ratio for yawning detection"""
+        if njit is not None:
+            return _mar_kernel(np.ascontiguousarray(mouth, dtype=np.float32))
+        mouth = np.asarray(mouth, dtype=np.float32)
        
         # vertical mouth landmarks
-        A = dist.euclidean(mouth[13], mouth[19])
-        B = dist.euclidean(mouth[14], mouth[18])
-        C = dist.euclidean(mouth[15], mouth[17])
+        v = np.linalg.norm(mouth[self._mouth_v[:, 0]] - mouth[self._mouth_v[:, 1]], axis=1)
         
-       
         # mouth landmark
-        D = dist.euclidean(mouth[12], mouth[16])
+        h = np.linalg.norm(mouth[self._mouth_h[0]] - mouth[self._mouth_h[1]])
         
         # the mouth aspect ratio
-        mar = (A + B + C) / (3.0 * D)
+        mar = v.sum() / (3.0 * h)
         return mar
     
+    def _ear_batch(self, eyes):
+        """Eye aspect ratios for an (N, 6, 2) stack of eyes"""
+        v = np.linalg.norm(eyes[:, self._eye_v[:, 0]] - eyes[:, self._eye_v[:, 1]], axis=2).sum(axis=1)
+        h = np.linalg.norm(eyes[:, self._eye_h[0]] - eyes[:, self._eye_h[1]], axis=1)
+        return v / (2.0 * h)
+    
     def detect_eye_blink(self, left_eye, right_eye):
         """Detect eye blink based on eye aspect ratio"""
-        left_ear = self.eye_aspect_ratio(left_eye)
-        right_ear = self.eye_aspect_ratio(right_eye)
+        if njit is not None:
+            # Two native calls beat NumPy's dispatch overhead on 6-point arrays
+            ear = (self.eye_aspect_ratio(left_eye) + self.eye_aspect_ratio(right_eye)) / 2.0
+        else:
+            ears = self._ear_batch(np.stack([left_eye, right_eye]).astype(np.float32))
+            
+            # Average the eye aspect ratio 
+            ear = ears.mean()
         
-        # Average the eye aspect ratio 
-        ear = (left_ear + right_ear) / 2.0
+        self.update_blink(ear)
+        return ear
+    
+    def update_blink(self, ear):
+        """Advance the blink counters with one frame's averaged eye aspect ratio"""
+        self._ear_recent.append(ear)
+        ear = sum(self._ear_recent) / len(self._ear_recent)
+        
+        # Learn this user's threshold from their first frames (default threshold meanwhile)
+        if self._ear_seen < self.EAR_BASELINE_FRAMES:
+            self._ear_baseline[self._ear_seen] = ear
+            self._ear_seen += 1
+            if self._ear_seen == self.EAR_BASELINE_FRAMES:
+                thresh = np.median(self._ear_baseline) - 2 * self._ear_baseline.std()
+                # Blinks during the baseline inflate sigma; never drop below a sane floor
+                self.EYE_AR_THRESH = max(float(thresh), self.EYE_AR_THRESH_MIN)
         
         # Check if eye aspect ratio is below the blink threshold
         if ear < self.EYE_AR_THRESH:
@@ -108,11 +225,10 @@ class LivenessDetector:
             # If eyes were closed long enough, count as a blink
             if self.consecutive_frames_eye_closed >= self.EYE_AR_CONSEC_FRAMES:
                 self.eye_blink_count += 1
+                self._recompute_score()
             
             # Reset the eye frame counter
             self.consecutive_frames_eye_closed = 0
-        
-        return ear
     
     def detect_yawning(self, mouth):
         """Detect yawning based on mouth aspect ratio"""
@@ -126,6 +242,7 @@ class LivenessDetector:
             if self.consecutive_frames_mouth_open >= 10:
                 self.yawn_count += 1
                 self.consecutive_frames_mouth_open = 0  
+                self._recompute_score()
         else:
             self.consecutive_frames_mouth_open = 0
         
@@ -134,29 +251,40 @@ class LivenessDetector:
     def track_head_movement(self, face_center):
         """Track head movement by monitoring face position changes"""
         if face_center is not None:
-            self.face_positions.append(face_center)
-            
-            # Keep only last 30 positions
-            if len(self.face_positions) > 30:
-                self.face_positions.pop(0)
+            # Keep only the last HEAD_MOVEMENT_WINDOW positions, updating the
+            # running mean/M2 (Welford) instead of recomputing the variance
+            self._rb_count = _welford_push(self.face_positions, self._rb_idx, self._rb_count,
+                                           self._mean, self._M2,
+                                           float(face_center[0]), float(face_center[1]))
+            self._rb_idx = (self._rb_idx + 1) % self.HEAD_MOVEMENT_WINDOW
             
             # Check for head movement after we have enough frames
-            if len(self.face_positions) >= self.MIN_FRAMES_FOR_HEAD_MOVEMENT:
-                # Calculate movement variance
-                positions_array = np.array(self.face_positions)
-                variance = np.var(positions_array, axis=0)
-                movement_score = np.mean(variance)
+            if self._rb_count >= self.MIN_FRAMES_FOR_HEAD_MOVEMENT:
+                # Calculate movement variance (population, as np.var)
+                variance = self._M2 / self._rb_count
+                movement_score = variance.mean()
                 
                 # If movement score exceeds threshold, mark as movement detected
                 if movement_score > self.HEAD_MOVEMENT_THRESH and not self.head_movement_detected:
                     self.head_movement_detected = True
+                    self._recompute_score()
                 
                 return movement_score
         
         return 0
     
+    def count_frame(self):
+        """Count one processed frame; the score only changes when the count reaches 15"""
+        self.total_frames_processed += 1
+        if self.total_frames_processed == 15:
+            self._recompute_score()
+    
     def calculate_liveness_score(self):
         """Calculate overall liveness score"""
+        return self._recompute_score()
+    
+    def _recompute_score(self):
+        """Rebuild liveness_score; called only when one of its inputs changes"""
         score = 0
         
         # Check for eye blinks 
@@ -179,7 +307,7 @@ class LivenessDetector:
     
     def is_live_face(self):
         """Determine if face is live based on liveness score"""
-        score = self.calculate_liveness_score()
+        score = self.liveness_score
         
         # Require at least 4 points out of possible 6 to be considered live
         self.is_live = score >= 4
@@ -223,12 +351,10 @@ class LivenessDetector:
         """Draw liveness information on the frame"""
         height, width = frame.shape[:2]
         
-        
-        overlay = frame.copy()
-        
-        # Draw semi-transparent background for text
-        cv2.rectangle(overlay, (10, 10), (width - 10, 180), (0, 0, 0), -1)
-        cv2.addWeighted(overlay, 0.7, frame, 0.3, 0, frame)
+        # Draw semi-transparent background for text: a 70% black blend is just the
+        # HUD band scaled to 30%, so only that strip is touched
+        hud = frame[10:181, 10:width - 9]
+        hud[...] = cv2.addWeighted(hud, 0.3, hud, 0.0, 0)
         
         # Draw liveness status with color coding
         status_color = (0, 255, 0) if self.is_live else (0, 0, 255)
@@ -268,6 +394,7 @@ class FaceLandmarkDetector:
         self.detector = None
         self.predictor = None
         self.initialized = False
+        self._unit_template = self.build_unit_template()
         
         try:
             import dlib
@@ -289,118 +416,195 @@ class FaceLandmarkDetector:
         
     def detect_landmarks(self, frame, face_rect):
         """Detect facial landmarks for a given face rectangle"""
+        return self.detect_landmarks_batch([frame], [face_rect])[0]
+    
+    def detect_landmarks_batch(self, frames, face_rects):
+        """Landmarks for each (frame, face rect) pair, as an (N, 68, 2) int16 array"""
+        rects = np.asarray(face_rects, dtype=np.float32).reshape(-1, 4)
         if not self.initialized or self.predictor is None:
-            return self.simplified_landmarks(face_rect)
-        
-        try:
-            import dlib
-            # Convert face rectangle to dlib rectangle
-            dlib_rect = dlib.rectangle(face_rect[0], face_rect[1], 
-                                      face_rect[0] + face_rect[2], 
-                                      face_rect[1] + face_rect[3])
-            
-            # Detect landmarks
-            landmarks = self.predictor(frame, dlib_rect)
-            
-            # Convert landmarks to numpy array
-            landmarks_np = np.zeros((68, 2), dtype=int)
-            for i in range(68):
-                landmarks_np[i] = (landmarks.part(i).x, landmarks.part(i).y)
-            
-            return landmarks_np
-        except Exception as e:
-            print(f"Landmark detection error: {e}")
-            return self.simplified_landmarks(face_rect)
+            # Template scaled onto every rect at once
+            return (self._unit_template[None] * rects[:, None, 2:4] + rects[:, None, 0:2]).astype(np.int16)
+        
+        import dlib
+        out = np.empty((len(frames), 68, 2), dtype=np.int16)
+        for n, (frame, face_rect) in enumerate(zip(frames, face_rects)):
+            try:
+                # Convert face rectangle to dlib rectangle
+                x, y, w, h = (int(v) for v in face_rect)
+                shape = self.predictor(frame, dlib.rectangle(x, y, x + w, y + h))
+                out[n] = [(p.x, p.y) for p in shape.parts()]
+            except Exception as e:
+                print(f"Landmark detection error: {e}")
+                out[n] = self.simplified_landmarks(face_rect)
+        return out
     
     def simplified_landmarks(self, face_rect):
         """Generate simplified landmarks based on face rectangle"""
         x, y, w, h = face_rect
         
-        # Create approximate landmarks
-        landmarks = np.zeros((68, 2), dtype=int)
+        # Scale the unit-square template onto the face rectangle
+        landmarks = self._unit_template * np.array([w, h], dtype=np.float32) + np.array([x, y], dtype=np.float32)
+        return landmarks.astype(np.int16)
+    
+    @staticmethod
+    def build_unit_template():
+        """Approximate 68-point layout in face-rectangle units, as a (68, 2) float32 array"""
+        template = np.zeros((68, 2), dtype=np.float32)
         
         # Jaw line
         for i in range(17):
-            landmarks[i] = (x + int(w * i / 16), y + h)
+            template[i] = (i / 16, 1.0)
         
         # Left eyebrow 
         for i in range(5):
-            landmarks[17 + i] = (x + int(w * (i + 1) / 6), y + int(h * 0.2))
+            template[17 + i] = ((i + 1) / 6, 0.2)
         
         # Right eyebrow 
         for i in range(5):
-            landmarks[22 + i] = (x + int(w * (i + 4) / 6), y + int(h * 0.2))
+            template[22 + i] = ((i + 4) / 6, 0.2)
         
         # Nose 
-        nose_points = [(0.35, 0.4), (0.5, 0.3), (0.65, 0.4), 
-                      (0.5, 0.6), (0.5, 0.7), (0.5, 0.8),
-                      (0.4, 0.9), (0.5, 0.95), (0.6, 0.9)]
-        
-        for i in range(9):
-            landmarks[27 + i] = (x + int(w * nose_points[i][0]), 
-                                y + int(h * nose_points[i][1]))
+        template[27:36] = [(0.35, 0.4), (0.5, 0.3), (0.65, 0.4), 
+                           (0.5, 0.6), (0.5, 0.7), (0.5, 0.8),
+                           (0.4, 0.9), (0.5, 0.95), (0.6, 0.9)]
         
         # Left eye 
-        eye_points = [(0.3, 0.35), (0.35, 0.3), (0.4, 0.35),
-                     (0.35, 0.4), (0.3, 0.4), (0.35, 0.45)]
-        
-        for i in range(6):
-            landmarks[36 + i] = (x + int(w * eye_points[i][0]), 
-                                y + int(h * eye_points[i][1]))
+        eye_points = np.array([(0.3, 0.35), (0.35, 0.3), (0.4, 0.35),
+                               (0.35, 0.4), (0.3, 0.4), (0.35, 0.45)], dtype=np.float32)
+        template[36:42] = eye_points
         
         # Right eye 
-        for i in range(6):
-            landmarks[42 + i] = (x + int(w * (eye_points[i][0] + 0.3)), 
-                                y + int(h * eye_points[i][1]))
+        template[42:48] = eye_points + (0.3, 0.0)
         
         # Mouth 
-        mouth_points = [(0.3, 0.7), (0.35, 0.65), (0.4, 0.7), (0.45, 0.65), 
-                       (0.5, 0.7), (0.55, 0.65), (0.6, 0.7), (0.65, 0.65),
-                       (0.7, 0.7), (0.65, 0.75), (0.6, 0.8), (0.55, 0.75),
-                       (0.5, 0.8), (0.45, 0.75), (0.4, 0.8), (0.35, 0.75),
-                       (0.3, 0.8), (0.35, 0.85), (0.5, 0.85), (0.65, 0.85)]
-        
-        for i in range(20):
-            landmarks[48 + i] = (x + int(w * mouth_points[i][0]), 
-                                y + int(h * mouth_points[i][1]))
+        template[48:68] = [(0.3, 0.7), (0.35, 0.65), (0.4, 0.7), (0.45, 0.65), 
+                           (0.5, 0.7), (0.55, 0.65), (0.6, 0.7), (0.65, 0.65),
+                           (0.7, 0.7), (0.65, 0.75), (0.6, 0.8), (0.55, 0.75),
+                           (0.5, 0.8), (0.45, 0.75), (0.4, 0.8), (0.35, 0.75),
+                           (0.3, 0.8), (0.35, 0.85), (0.5, 0.85), (0.65, 0.85)]
         
-        return landmarks
+        return template
 
 # Main Liveness Processor
 class LivenessProcessor:
-    def __init__(self):
+    def __init__(self, debug_draw=True, draw=True):
+        # Landmark dots, outlines and EAR/MAR text on the frame; off in production
+        self.debug_draw = debug_draw and draw
         self.liveness_detector = LivenessDetector()
+        # Headless callers (draw=False) only want the status dict, so the HUD is
+        # bound to a no-op once here rather than checked every frame
+        self._draw_hud = self.liveness_detector.draw_liveness_info if draw else (lambda frame, face_rect: frame)
         self.landmark_detector = FaceLandmarkDetector()
         self.face_cascade = None
         
-        # Initialize OpenCV face cascade
-        cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        if os.path.exists(cascade_path):
-            self.face_cascade = cv2.CascadeClassifier(cascade_path)
-        
-    def detect_face(self, frame):
+        # Initialize OpenCV face cascade (a missing or unreadable file loads as empty)
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        if not cascade.empty():
+            self.face_cascade = cascade
+        
+        # Run the cascade at most this often (seconds); frames in between follow
+        # the last detection with optical flow
+        self.DETECTION_INTERVAL = 0.1
+        # The cascade scans a copy of the frame at most this wide
+        self._det_width = 320
+        self.TRACK_MAX_ERROR = 20.0
+        self._last_rect = None
+        self._last_det_ts = 0.0
+        self._prev_gray = None
+        
+        # With an OpenCL device, color conversion, resize, the cascade and optical flow
+        # run on it through UMat; frames only come back to host memory for dlib
+        self._use_opencl = cv2.ocl.haveOpenCL()
+        if self._use_opencl:
+            cv2.ocl.setUseOpenCL(True)
+        
+    @staticmethod
+    def _host(img):
+        """numpy view of an image that may be a UMat"""
+        return img.get() if isinstance(img, cv2.UMat) else img
+    
+    def detect_face(self, frame, gray=None):
         """Detect face in frame using OpenCV cascade"""
         if self.face_cascade is None:
             return None
         
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if gray is None:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        
+        # Cascade cost is linear in pixels, so scan a downscaled copy and map the rect back
+        scale = min(1.0, self._det_width / frame.shape[1])
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        min_side = max(1, int(30 * scale))
         faces = self.face_cascade.detectMultiScale(
             gray,
             scaleFactor=1.1,
             minNeighbors=5,
-            minSize=(30, 30)
+            minSize=(min_side, min_side)
         )
         
         if len(faces) > 0:
-            return faces[0]  
+            return tuple(int(round(v / scale)) for v in faces[0])
         return None
     
+    def track_face(self, gray):
+        """Shift the last detected face rect by the optical flow of its center, or None if tracking is lost"""
+        x, y, w, h = self._last_rect
+        p0 = np.array([[[x + w / 2.0, y + h / 2.0]]], dtype=np.float32)
+        p1, status, err = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, p0, None,
+                                                   winSize=(21, 21), maxLevel=2)
+        if p1 is None:
+            return None
+        p1, status, err = self._host(p1), self._host(status), self._host(err)
+        if not status[0][0] or err[0][0] > self.TRACK_MAX_ERROR:
+            return None
+        dx, dy = p1[0][0] - p0[0][0]
+        return (int(round(x + dx)), int(round(y + dy)), w, h)
+    
+    def locate_face(self, frame):
+        """Cascade detection every DETECTION_INTERVAL, optical-flow tracking in between; returns (rect, gray)"""
+        now = time.time()
+        src = cv2.UMat(frame) if self._use_opencl else frame
+        gray = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
+        face_rect = None
+        if self._last_rect is not None and now - self._last_det_ts <= self.DETECTION_INTERVAL:
+            face_rect = self.track_face(gray)
+        if face_rect is None:
+            face_rect = self.detect_face(frame, gray)
+            self._last_det_ts = now
+        self._last_rect = face_rect
+        self._prev_gray = gray
+        return face_rect, gray
+    
     def process_frame(self, frame):
         """Process a single frame for liveness detection"""
-        self.liveness_detector.total_frames_processed += 1
-        
-        # Detect face
-        face_rect = self.detect_face(frame)
+        return self.process_frames([frame])[0]
+    
+    def process_frames(self, frames):
+        """Process consecutive frames as one micro-batch; returns a (frame, face_rect, status) per frame"""
+        # Detect faces (sequential - tracking follows the previous frame)
+        located = [self.locate_face(frame) for frame in frames]
+        face_rects = [face_rect for face_rect, _ in located]
+        found = [i for i, face_rect in enumerate(face_rects) if face_rect is not None]
+        
+        # Detect facial landmarks and both eyes' EAR for every found face in one go
+        landmarks_by_frame, ear_by_frame = {}, {}
+        if found:
+            # The predictor reads intensities only, so it gets the gray image converted once above
+            landmarks = self.landmark_detector.detect_landmarks_batch(
+                [self._host(located[i][1]) for i in found], [face_rects[i] for i in found])
+            eyes = np.concatenate([landmarks[:, 36:42], landmarks[:, 42:48]]).astype(np.float32)
+            ears = self.liveness_detector._ear_batch(eyes).reshape(2, -1).mean(axis=0)
+            landmarks_by_frame = dict(zip(found, landmarks))
+            ear_by_frame = dict(zip(found, ears))
+        
+        # Counters advance frame by frame, in capture order
+        return [self._process_located(frame, face_rects[i], landmarks_by_frame.get(i), ear_by_frame.get(i))
+                for i, frame in enumerate(frames)]
+    
+    def _process_located(self, frame, face_rect, landmarks, ear):
+        """Update liveness state from one frame's face rect, landmarks and EAR"""
+        self.liveness_detector.count_frame()
         
         if face_rect is None:
             
@@ -412,42 +616,40 @@ class LivenessProcessor:
         # Track head movement
         movement_score = self.liveness_detector.track_head_movement(face_center)
         
-        # Detect facial landmarks
-        landmarks = self.landmark_detector.dect_landmarks(frame, face_rect)
-        
         if landmarks is not None and len(landmarks) >= 68:
-            # Extract eye and mouth regions
-            left_eye = landmarks[36:42]
-            right_eye = landmarks[42:48]
+            # Extract mouth region (the eyes' EAR was computed for the whole batch)
             mouth = landmarks[48:68]
             
             # Detect eye blink
-            ear = self.liveness_detector.detect_eye_blink(left_eye, right_eye)
+            self.liveness_detector.update_blink(ear)
             
             # Detect yawning
             mar = self.liveness_detector.detect_yawning(mouth)
             
-            # Draw landmarks for visualization
-            for (x_lm, y_lm) in landmarks:
-                cv2.circle(frame, (x_lm, y_lm), 1, (0, 255, 255), -1)
-            
-            # Draw eye and mouth outlines
-            cv2.polylines(frame, [left_eye], True, (0, 255, 0), 1)
-            cv2.polylines(frame, [right_eye], True, (0, 255, 0), 1)
-            cv2.polylines(frame, [mouth], True, (255, 0, 0), 1)
-            
-            # Display EAR and MAR values
-            cv2.putText(frame, f"EAR: {ear:.2f}", (x, y + h + 20),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-            cv2.putText(frame, f"MAR: {mar:.2f}", (x, y + h + 40),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
-        
-        # Calculate liveness score
-        self.liveness_detector.calculate_liveness_score()
+            if self.debug_draw:
+                # Draw landmarks for visualization, as single pixels in one scatter
+                # (landmarks are int16; OpenCV drawing wants int32 points)
+                lm = landmarks.astype(np.int32)
+                xs = np.clip(lm[:, 0], 0, frame.shape[1] - 1)
+                ys = np.clip(lm[:, 1], 0, frame.shape[0] - 1)
+                frame[ys, xs] = (0, 255, 255)
+                
+                # Draw eye and mouth outlines
+                cv2.polylines(frame, [lm[36:42]], True, (0, 255, 0), 1)
+                cv2.polylines(frame, [lm[42:48]], True, (0, 255, 0), 1)
+                cv2.polylines(frame, [lm[48:68]], True, (255, 0, 0), 1)
+                
+                # Display EAR and MAR values
+                cv2.putText(frame, f"EAR: {ear:.2f}", (x, y + h + 20),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+                cv2.putText(frame, f"MAR: {mar:.2f}", (x, y + h + 40),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
+        
+        # Liveness score is kept current by the counters; just apply the verdict
         self.liveness_detector.is_live_face()
         
         # Draw liveness information on frame
-        frame = self.liveness_detector.draw_liveness_info(frame, face_rect)
+        frame = self._draw_hud(frame, face_rect)
         
         # Get liveness status
         liveness_status = self.liveness_detector.get_liveness_status()
@@ -457,6 +659,8 @@ class LivenessProcessor:
     def reset_liveness_check(self):
         """Reset liveness check"""
         self.liveness_detector.reset()
+        self._last_rect = None
+        self._prev_gray = None
     
     def start_liveness_check(self):
         """Start a new liveness check"""
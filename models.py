@@ -1,8 +1,8 @@
 
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from utils import utcnow
 
 db = SQLAlchemy()
 
@@ -36,7 +36,7 @@ class User(db.Model, UserMixin):
     role = db.Column(db.String(32), default='professor')
     department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
     password_change_required = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow)
 
     subjects = db.relationship('Subject', backref='professor', lazy=True)
     students = db.relationship('Student', backref='professor_user', lazy=True)
@@ -60,6 +60,8 @@ class Subject(db.Model):
     students = db.relationship('Student', backref='subject', lazy=True)
     sessions = db.relationship('ClassSession', backref='subject', lazy=True)
 
+    __table_args__ = (db.Index('ix_subject_prof', 'professor_id'),)
+
 
 class Student(db.Model, UserMixin):
     __tablename__ = "student"
@@ -71,16 +73,25 @@ class Student(db.Model, UserMixin):
     department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'))
     professor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow)
     eligible_override = db.Column(db.Boolean, default=False)
 
     
     attendances = db.relationship('Attendance', backref='student_ref', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_student_subject', 'subject_id'),
+        db.Index('ix_student_dept_subject', 'department_id', 'subject_id'),
+    )
+
     def get_id(self):
         return f"student:{self.id}"
 
 
+# Case-insensitive roll lookups at login compare lower(roll)
+db.Index('ix_student_roll_lower', db.func.lower(Student.roll))
+
+
 class ClassSession(db.Model):
     __tablename__ = "class_session"
     id = db.Column(db.Integer, primary_key=True)
@@ -90,16 +101,26 @@ class ClassSession(db.Model):
     end_time = db.Column(db.DateTime)
     attendances = db.relationship('Attendance', backref='class_session', lazy=True)
 
+    __table_args__ = (db.Index('ix_cs_subj_date', 'subject_id', 'date'),)
+
 
 class Attendance(db.Model):
     __tablename__ = "attendance"
     id = db.Column(db.Integer, primary_key=True)
-    class_session_id = db.Column(db.Integer, db.ForeignKey('class_session.id'))
+    class_session_id = db.Column(db.Integer, db.ForeignKey('class_session.id', ondelete='CASCADE'))
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=utcnow)
     status = db.Column(db.String(32), default='present')
     confidence = db.Column(db.Float, nullable=True)
     reason = db.Column(db.Text, nullable=True)
     edited = db.Column(db.Boolean, default=False)
 
     student = db.relationship('Student', backref='attendance_records')
+
+    __table_args__ = (
+        # One mark per student per session; also serves session-only lookups
+        db.Index('ix_att_sess_stu', 'class_session_id', 'student_id', unique=True),
+        # Student history/dashboard; on Postgres the INCLUDE columns make it index-only
+        db.Index('ix_att_stu_sess', 'student_id', 'class_session_id',
+                 postgresql_include=['status', 'confidence', 'timestamp']),
+    )
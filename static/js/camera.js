@@ -395,6 +395,14 @@ class BeautifulCamera {
       this.startLivenessChecking(video);
     }
 
+    // Stream frames over a WebSocket when the server offers one
+    if (typeof io !== 'undefined' && !this.socket) {
+      this.socket = io('/attendance');
+      this.socket.on('results', data => {
+        (data.results || []).forEach(result => this.processRecognitionResult(result));
+      });
+    }
+
     this.markInterval = setInterval(async () => {
       try {
         // Check liveness before proceeding
@@ -416,16 +424,28 @@ class BeautifulCamera {
         }
 
         const video = document.getElementById('video');
-        const dataUrl = this.getImageDataUrl(video);
+        const blob = await this.getImageBlob(video);
+
+        if (this.socket) {
+          // Results arrive asynchronously on the socket's 'results' event
+          this.socket.emit('frame', {
+            image: await blob.arrayBuffer(),
+            subject_id: subject_id,
+            session_id: session_id,
+            liveness_data: this.currentLivenessData || {}
+          });
+          return;
+        }
+
+        const form = new FormData();
+        form.append('image', blob, 'frame.jpg');
+        form.append('session_id', session_id);
+        // Send liveness data for server verification
+        form.append('liveness_data', JSON.stringify(this.currentLivenessData || {}));
         
         const resp = await fetch(`/prof/${subject_id}/recognize`, {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ 
-            image: dataUrl, 
-            session_id: session_id,
-            liveness_data: this.currentLivenessData // Send liveness data for server verification
-          })
+          body: form
         });
 
         if (!resp.ok) throw new Error('Network error');
@@ -575,6 +595,15 @@ class BeautifulCamera {
     ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
     return canvas.toDataURL('image/jpeg', 0.8);
   }
+
+  getImageBlob(video) {
+    const canvas = document.createElement('canvas');
+    canvas.width = video.videoWidth || 640;
+    canvas.height = video.videoHeight || 480;
+    const ctx = canvas.getContext('2d');
+    ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+    return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.8));
+  }
 }
 
 // Initialize global camera instance
@@ -1,20 +1,43 @@
 
 import cv2
 import base64
+import queue
+import threading
 from liveness_detector import get_detector
 
+def capture_frames(cap, frames, stop):
+    """Read frames into a one-slot queue, replacing any frame the consumer hasn't taken yet"""
+    frame = True
+    while frame is not None:
+        ret, frame = cap.read()
+        if not ret or stop.is_set():
+            frame = None  # tells the consumer the camera is done
+        try:
+            frames.get_nowait()
+        except queue.Empty:
+            pass
+        frames.put(frame)
+
 def test_with_camera():
     """Test liveness detection with webcam"""
     detector = get_detector()
     cap = cv2.VideoCapture(0)
+    # Keep the driver from queueing stale frames behind the one we read
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
     
     print("🎥 Starting liveness detection test...")
     print("Press 'q' to quit")
     print("Move your head and blink naturally")
     
+    # Camera reads overlap detection; the display stays on this (GUI) thread
+    frames = queue.Queue(maxsize=1)
+    stop = threading.Event()
+    capture = threading.Thread(target=capture_frames, args=(cap, frames, stop), daemon=True)
+    capture.start()
+    
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        frame = frames.get()
+        if frame is None:
             break
         
         # Test liveness detection
@@ -36,6 +59,8 @@ def test_with_camera():
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
     
+    stop.set()
+    capture.join(timeout=1)
     cap.release()
     cv2.destroyAllWindows()
 
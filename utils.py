@@ -1,7 +1,175 @@
 
 import os
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+def utcnow():
+    """Naive UTC now, matching the naive DateTime columns, without the deprecated utcnow()"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 def ensure_instance_dirs(paths):
     for p in paths:
         if not os.path.exists(p):
             os.makedirs(p, exist_ok=True)
+
+
+def list_subdirs(path):
+    """Names of the subdirectories of path, from one scandir pass"""
+    try:
+        with os.scandir(path) as it:
+            return [e.name for e in it if e.is_dir(follow_symlinks=False)]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def list_jpgs(path):
+    """Sorted paths of the .jpg files in path, from one scandir pass"""
+    try:
+        with os.scandir(path) as it:
+            return sorted(e.path for e in it
+                          if e.name.endswith('.jpg') and e.is_file(follow_symlinks=False))
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def count_jpgs(path):
+    try:
+        with os.scandir(path) as it:
+            return sum(1 for e in it if e.name.endswith('.jpg') and e.is_file(follow_symlinks=False))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+
+
+class ProgressStore:
+    """Thread-safe training progress registry; entries expire ttl seconds after their last write"""
+
+    def __init__(self, cap=256, ttl=3600):
+        self._d = OrderedDict()  # key -> (expires_at, info), oldest write first
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._version = 0
+        self._cap = cap
+        self._ttl = ttl
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._d and (len(self._d) > self._cap or next(iter(self._d.values()))[0] <= now):
+            self._d.popitem(last=False)
+
+    def _write(self, key, info):
+        self._d[key] = (time.monotonic() + self._ttl, info)
+        self._d.move_to_end(key)
+        self._expire()
+        self._version += 1
+        self._changed.notify_all()
+
+    def _live(self, key):
+        self._expire()
+        entry = self._d.get(key)
+        return entry[1] if entry is not None else None
+
+    def __setitem__(self, key, info):
+        with self._lock:
+            self._write(key, dict(info))
+
+    def update(self, key, fields):
+        """Merge fields into the entry for key, creating it if needed"""
+        with self._lock:
+            info = dict(self._live(key) or {})
+            info.update(fields)
+            self._write(key, info)
+
+    def get(self, key, default=None):
+        """Return a snapshot of the entry for key"""
+        with self._lock:
+            info = self._live(key)
+            return dict(info) if info is not None else default
+
+    def wait(self, key, version, timeout=15):
+        """Block until the store changes past version, return (version, snapshot of key)"""
+        with self._lock:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            info = self._live(key)
+            return self._version, dict(info) if info is not None else None
+
+
+class RedisProgressStore:
+    """ProgressStore backed by Redis so every worker process sees the same progress"""
+
+    def __init__(self, client, ttl=3600):
+        self._client = client
+        self._ttl = ttl
+
+    def _key(self, key):
+        return f'train:{key}'
+
+    def __setitem__(self, key, info):
+        self._client.set(self._key(key), json.dumps(info), ex=self._ttl)
+
+    def update(self, key, fields):
+        info = self.get(key, {})
+        info.update(fields)
+        self[key] = info
+
+    def get(self, key, default=None):
+        raw = self._client.get(self._key(key))
+        if raw is None:
+            return default
+        return json.loads(raw)
+
+    def wait(self, key, version, timeout=15):
+        # No change notifications across processes, so poll at a gentle rate
+        time.sleep(min(timeout, 1))
+        return version + 1, self.get(key)
+
+
+def make_progress_store(cap=256, ttl=3600):
+    """Use Redis when REDIS_URL is set and redis is installed, else an in-process store"""
+    url = os.environ.get('REDIS_URL')
+    if url:
+        try:
+            import redis
+            return RedisProgressStore(redis.Redis.from_url(url), ttl)
+        except ImportError:
+            pass
+    return ProgressStore(cap, ttl)
+
+
+class AttemptLimiter:
+    """Counts failed password checks per key and locks the key out after too many in a window"""
+
+    def __init__(self, max_attempts=5, window=300, cap=4096):
+        self._d = OrderedDict()  # key -> (failures, window start)
+        self._lock = threading.Lock()
+        self._max = max_attempts
+        self._window = window
+        self._cap = cap
+
+    def blocked(self, key):
+        with self._lock:
+            entry = self._d.get(key)
+            if entry is None:
+                return False
+            failures, start = entry
+            if time.monotonic() - start > self._window:
+                del self._d[key]
+                return False
+            return failures >= self._max
+
+    def fail(self, key):
+        with self._lock:
+            now = time.monotonic()
+            failures, start = self._d.get(key, (0, now))
+            if now - start > self._window:
+                failures, start = 0, now
+            self._d[key] = (failures + 1, start)
+            self._d.move_to_end(key)
+            while len(self._d) > self._cap:
+                self._d.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._d.pop(key, None)